@@ -1,15 +1,274 @@
 import json
+import logging
 import os
-import sys
+import re
+import time
 import contextlib
+import itertools
+import atexit
+import queue
+import threading
+import uuid
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
-from datetime import datetime
+from functools import cached_property, lru_cache, partial
+from types import MappingProxyType
+from typing import Deque, List, Dict, Any, Mapping, Optional, Tuple
 
 from google import genai
 from google.genai import types
 
+try:
+    # Optional: streams multipart uploads from disk instead of building the body in memory
+    from requests_toolbelt.multipart.encoder import MultipartEncoder
+except ImportError:
+    MultipartEncoder = None
+
+try:
+    # Optional: C JSON parser/serializer for model responses and backend form fields
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    # Same compact output as orjson
+    _json_dumps = partial(json.dumps, separators=(',', ':'), ensure_ascii=False)
+
+
+# Debug output; formatting is skipped unless DEBUG is enabled (see agent_direct.py)
+logger = logging.getLogger(__name__)
+
+# URL prefixes recognized as image links
+_URL_SCHEMES = ('http://', 'https://')
+# Pattern to match HTTP/HTTPS URLs
+_URL_RE = re.compile(r'https?://[^\s]+')
+# Matches file paths: /path/to/file.jpg, ./file.png, ~/file.jpg, file.jpeg, etc.
+# '/' only ends a directory segment (never repeats inside one), so a failed match
+# can't backtrack exponentially. Group 1 is the extension.
+_FILE_RE = re.compile(
+    r'(?:\.{0,2}/)?(?:[\w\-~/]+/)*[\w\-]+\.(jpe?g|png|gif|webp|bmp)',
+    re.IGNORECASE,
+)
+# _FILE_RE.search() backtracks badly on long runs of path characters, so
+# _search_file_path finds the first extension that can end a path and walks back
+# over the reversed text to where that path starts (both linear). A directory part
+# that is exactly "//" can't take a ./ or ../ prefix, as in _FILE_RE.
+_FILE_EXT_RE = re.compile(r'(?<=[\w\-])\.(jpe?g|png|gif|webp|bmp)', re.IGNORECASE)
+_FILE_PATH_REVERSED_RE = re.compile(
+    r'[\w\-]+(?:(//)(?![\w\-~/])|/[\w\-~/]*)?(?(1)|(?:(?<=/)\.{1,2})?)'
+)
+# Either marker the model uses to request direct image generation (single scan)
+_IMAGE_TRIGGER_RE = re.compile(r'\[TRIGGER_GENERATE_NANOBANANA\]|CALL_TOOL: GENERATE_IMAGE')
+# PRODUCT_IMAGE / PROMPT / CAPTION lines of a [TRIGGER_GENERATE_REEL] block
+_REEL_FIELDS_RE = re.compile(r'^[^\S\n]*(PRODUCT_IMAGE|PROMPT|CAPTION):(.*)$', re.MULTILINE)
+# Body of a model response wrapped in a ```json fence (closing fence optional)
+_JSON_FENCE_RE = re.compile(r'^```(?:json)?(.*?)(?:```|\Z)', re.DOTALL)
+# Separators between overlay text pieces: newlines and the conjunction " y "
+_TEXT_SPLIT_RE = re.compile(r'\n| [yY] ')
+# Quotes, commas and whitespace trimmed from each overlay text piece; the whitespace
+# is every str.isspace() character, the same set a bare .strip() removes
+_TEXT_STRIP_CHARS = (
+    '"\','
+    ' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f\x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004'
+    '\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+)
+# "KEY: value" parameter lines of the search / pipeline tool triggers
+_TOOL_PARAM_RE = re.compile(r'^[^\S\n]*(QUERY|LIMIT|REFERENCE_IMAGE|PROMPT|SKIP_TEXT):(.*)$', re.MULTILINE)
+# Reference fields joined (when present) into the description shown to the user
+_REFERENCE_DESC_KEYS = ('industry', 'aesthetic', 'mood')
+# Runs of whitespace, collapsed to a single space in cleaned messages
+_WS_RE = re.compile(r'\s+')
+# First "IMAGE_PROMPT:" / "PROMPT:" line in a model response (value in group 1)
+_PROMPT_LINE_RE = re.compile(r'^[^\S\n]*(?:IMAGE_)?PROMPT:(.*)$', re.MULTILINE)
+
+# Max messages kept per agent; older turns are evicted automatically
+HISTORY_MAXLEN = 64
+# Number of recent messages sent to the text model as conversation context
+CONVERSATION_WINDOW = 12
+
+# Image file extension -> MIME type
+_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+}
+
+# Shared HTTP session for image downloads (keep-alive + pooled connections)
+_HTTP = requests.Session()
+_HTTP.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=2))
+_HTTP.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=2))
+# Browser-like headers to avoid 403 Forbidden errors from websites
+_HTTP.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+})
+
+# Shared keep-alive session for calls to the Postty backend (BACKEND_URL).
+# No retries: backend POSTs (e.g. /video/generate) are not idempotent.
+_BACKEND_HTTP = requests.Session()
+_BACKEND_HTTP.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_BACKEND_HTTP.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Worker pool for fetching several images referenced in one message
+_IMAGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="image-load")
+
+# Worker pool for fire-and-forget backend calls that must not delay the reply
+_BACKGROUND_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="backend-bg")
+
+# Upper bound for downloaded images, enforced while streaming the body
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+
+
+class _ImageCache:
+    """
+    Thread-safe LRU of downloaded images ({url: (bytes, mime_type)}), bounded by
+    total size so a long-running multi-session process can't pin unbounded memory.
+    Bodies larger than max_item_bytes are never cached.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: int):
+        self._max_bytes = max_bytes
+        self._max_item_bytes = max_item_bytes
+        self._entries: "OrderedDict[str, tuple[bytes, str]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url: str, entry: tuple[bytes, str]) -> None:
+        size = len(entry[0])
+        if size > self._max_item_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._entries[url] = entry
+            self._size += size
+            while self._size > self._max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def discard(self, url: str) -> None:
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._size -= len(old[0])
+
+
+# Memoized image downloads: 64 MB total, images over 4 MB are re-downloaded
+_IMAGE_CACHE = _ImageCache(max_bytes=64 * 1024 * 1024, max_item_bytes=4 * 1024 * 1024)
+
+# Generated image filenames: local timestamp plus a per-process counter
+_TIMESTAMP_FMT = "%Y%m%d_%H%M%S"
+_image_counter = itertools.count()
+
+
+class _HistoryLog:
+    """
+    Append-only JSONL log of chat messages.
+    Messages are queued by the agent and serialized + written by a background
+    thread, so a turn never blocks on disk; a burst of messages becomes one write.
+    """
+
+    def __init__(self, path: str):
+        self._queue: "queue.SimpleQueue[Optional[Dict[str, Any]]]" = queue.SimpleQueue()
+        self._file = open(path, "ab")
+        self._thread = threading.Thread(target=self._run, name="history-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, entry: Dict[str, Any]) -> None:
+        self._queue.put(entry)
+
+    def close(self) -> None:
+        """Flush pending messages and stop the writer thread."""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            with contextlib.suppress(queue.Empty):
+                while True:
+                    batch.append(self._queue.get_nowait())
+            try:
+                lines = [json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in batch if entry is not None]
+                if lines:
+                    self._file.write("".join(lines).encode("utf-8"))
+                    self._file.flush()
+            except Exception:
+                # Drop the batch but keep draining, so a full disk can't pile up the queue
+                logger.exception("History log write failed; messages dropped")
+            if None in batch:
+                with contextlib.suppress(OSError):
+                    self._file.close()
+                return
+
+
+def _open_history_log(path: Optional[str]) -> Optional[_HistoryLog]:
+    """Open the history log (creating its directory); an unusable path disables it instead of failing import."""
+    if not path:
+        return None
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return _HistoryLog(path)
+    except OSError as e:
+        logger.warning("History log disabled, cannot open %s: %s", path, e)
+        return None
+
+
+# Optional persistence of chat history (one JSON object per line), off unless configured
+_HISTORY_LOG_PATH = os.environ.get("AGENT_HISTORY_LOG")
+_HISTORY_LOG = _open_history_log(_HISTORY_LOG_PATH)
+
+# Fixed pieces of the text-model prompt, around the conversation
+_PROMPT_CONVERSATION_HEADER = "\n\n---\n\nCONVERSATION SO FAR:\n"
+_PROMPT_SUFFIX = """
+
+---
+
+INSTRUCTIONS:
+Follow your workflow as defined in the system instructions above. Have a natural conversation with the user.
+
+When you're ready to generate an image, use this exact format:
+[TRIGGER_GENERATE_NANOBANANA]
+IMAGE_PROMPT: <detailed single-line prompt for image generation>
+
+Otherwise, respond naturally to continue the conversation."""
+
+
+def _keyword_re(keywords: List[str]) -> re.Pattern:
+    """Compile keywords into one case-insensitive alternation (single scan per message)."""
+    return re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+
+
+# User wants to start over with a new product
+_START_OVER_RE = _keyword_re([
+    'otro producto', 'nueva imagen', 'nuevo producto', 'empezar de nuevo',
+    'start over', 'different product', 'another product', 'new product',
+    'quiero crear otra', 'vamos a crear una nueva', 'crear algo con otro',
+    'imagen de producto nueva', 'producto nueva'
+])
+# User wants the post without text overlay
+_NO_TEXT_RE = _keyword_re(['sin texto', 'no texto', 'sin text', 'no text', 'imagen sola', 'ninguno', 'nada', 'skip'])
+# CTA (call to action) phrases in user text
+_CTA_RE = _keyword_re(['comprá', 'compra', 'buy', 'shop', 'link en bio', 'link in bio', 'visita', 'visit', 'descubrí', 'descubre'])
+
 
 @dataclass
 class AgentConfig:
@@ -17,23 +276,30 @@ class AgentConfig:
     region: str
     text_model: str
     image_model: str
-    system_instructions: str
+    prompt_path: str = "prompt.md"
+
+    @cached_property
+    def system_instructions(self) -> str:
+        # Read system instructions from prompt.md file on first access
+        with open(self.prompt_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    @cached_property
+    def prompt_prefix(self) -> str:
+        # Static head of the text-model prompt, shared by every agent using this config
+        return "".join((self.system_instructions.lstrip(), _PROMPT_CONVERSATION_HEADER))
 
 
 def load_config(path: str = "agent_config.json", prompt_path: str = "prompt.md") -> AgentConfig:
     with open(path, "r", encoding="utf-8") as f:
         raw = json.load(f)
     
-    # Read system instructions from prompt.md file
-    with open(prompt_path, "r", encoding="utf-8") as f:
-        system_instructions = f.read()
-    
     return AgentConfig(
         agent_id=raw["agent_id"],
         region=raw["region"],
         text_model=raw["text_model"],
         image_model=raw["image_model"],
-        system_instructions=system_instructions,
+        prompt_path=prompt_path,
     )
 
 
@@ -49,61 +315,133 @@ def _extract_image_bytes(resp) -> Optional[bytes]:
     return None
 
 
+def _search_file_path(message: str) -> Optional[re.Match]:
+    """Same result as _FILE_RE.search(message), in linear time."""
+    ext = _FILE_EXT_RE.search(message)
+    if ext is None:
+        return None
+    dot = ext.start()
+    start = dot - _FILE_PATH_REVERSED_RE.match(message[dot - 1::-1]).end()
+    return _FILE_RE.match(message, start)
+
+
 def _extract_image_url(message: str) -> tuple[str, Optional[str]]:
     """
     Extract image URL or file path from message text.
     Returns (clean_text, image_source) where image_source can be a URL or file path.
     """
-    import re
-    
-    # Pattern to match HTTP/HTTPS URLs
-    url_pattern = r'https?://[^\s]+'
-    
-    # Find all URLs in the message
-    urls = re.findall(url_pattern, message)
-    
-    if urls:
-        # Use the first URL found
-        image_source = urls[0]
-        # Remove the URL from the message to get clean text
-        clean_text = re.sub(re.escape(image_source), '', message).strip()
-    else:
-        # Look for file paths (common patterns)
-        # Matches: /path/to/file.jpg, ./file.png, ~/file.jpg, file.jpeg, etc.
-        file_pattern = r'(?:\.{0,2}/)?(?:[\w\-~/]+/)*[\w\-]+\.(?:jpg|jpeg|png|gif|webp|bmp)'
-        files = re.findall(file_pattern, message, re.IGNORECASE)
-        
-        if files:
-            image_source = files[0]
-            # Remove the file path from the message
-            clean_text = re.sub(re.escape(image_source), '', message).strip()
+    clean_text, image_source, _ = _extract_image_source(message)
+    return clean_text, image_source
+
+
+def _extract_image_source(message: str) -> tuple[str, Optional[str], Optional[str]]:
+    """
+    Same as _extract_image_url, plus the lowercased extension (e.g. '.png') of a
+    matched file path so loaders don't have to recompute it. The extension is None
+    for URLs (their MIME type comes from the response headers first).
+    """
+    # Scan whitespace-separated tokens for the first URL (cheap prefix test per token);
+    # messages without '://' skip the tokenization entirely
+    tokens = message.split() if '://' in message else ()
+    for i, token in enumerate(tokens):
+        if token.startswith(_URL_SCHEMES) and not token.endswith('://'):
+            start = 0
+        elif '://' in token and (url_match := _URL_RE.search(token)):
+            # URL glued to leading text, e.g. "foto:https://..."
+            start = url_match.start()
         else:
-            return message, None
-    
-    # Clean up extra whitespace
-    clean_text = ' '.join(clean_text.split())
+            continue
+        image_source = token[start:]
+        tokens[i] = token[:start]
+        # Re-joining the tokens also cleans up extra whitespace
+        return ' '.join(t for t in tokens if t), image_source, None
+
+    # Look for file paths (common patterns); a path needs a '.' before its extension
+    match = _search_file_path(message) if '.' in message else None
+    if match is None:
+        return message, None, None
+
+    image_source = match.group(0)
+    # Remove the file path from the message and clean up extra whitespace
+    clean_text = _WS_RE.sub(' ', message[:match.start()] + message[match.end():]).strip()
     
-    return clean_text, image_source
+    return clean_text, image_source, '.' + match.group(1).lower()
 
 
-def _get_mime_type_from_path(path: str) -> str:
-    """Determine MIME type from file extension."""
-    path_lower = path.lower()
-    if path_lower.endswith('.jpg') or path_lower.endswith('.jpeg'):
-        return 'image/jpeg'
-    elif path_lower.endswith('.png'):
-        return 'image/png'
-    elif path_lower.endswith('.webp'):
-        return 'image/webp'
-    elif path_lower.endswith('.gif'):
-        return 'image/gif'
-    elif path_lower.endswith('.bmp'):
-        return 'image/bmp'
-    else:
-        return 'image/jpeg'  # default
+def _write_bytes(path: str, data: bytes) -> None:
+    """Write data to path with raw os.write calls (no Python-level buffering/copy)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+    finally:
+        os.close(fd)
+
+
+def _post_multipart(url: str, data: Dict[str, str], files: Dict[str, Any], **kwargs) -> requests.Response:
+    """
+    POST multipart/form-data to the backend.
+    With requests-toolbelt installed the body is streamed from the open file objects
+    in chunks; otherwise `requests` reads every file into memory to build it.
+    """
+    if MultipartEncoder is None:
+        return _BACKEND_HTTP.post(url, data=data, files=files, **kwargs)
+    encoder = MultipartEncoder(fields={**data, **files})
+    headers = {**(kwargs.pop("headers", None) or {}), "Content-Type": encoder.content_type}
+    return _BACKEND_HTTP.post(url, data=encoder, headers=headers, **kwargs)
+
+
+def _increment_reference_ranking(backend_url: str, reference_filename: str) -> None:
+    """Tell the backend a reference was used (runs on _BACKGROUND_POOL; errors are only logged)."""
+    try:
+        logger.debug("Incrementing ranking for reference: %s", reference_filename)
+        _BACKEND_HTTP.post(
+            f'{backend_url}/increment-reference-ranking',
+            json={'referenceFilename': reference_filename},
+            timeout=5
+        )
+    except Exception as e:
+        logger.debug("Failed to increment ranking: %s", e)
+
+
+def _tool_params(response_text: str) -> Dict[str, str]:
+    """
+    Collect tool parameter lines from a model response in one scan.
+    The first non-empty REFERENCE_IMAGE wins; other keys keep their last occurrence.
+    """
+    params: Dict[str, str] = {}
+    for m in _TOOL_PARAM_RE.finditer(response_text):
+        key = m.group(1)
+        if key != "REFERENCE_IMAGE" or not params.get(key):
+            params[key] = m.group(2).strip()
+    return params
+
+
+def _render_message(message: Dict[str, Any]) -> str:
+    """Render a history entry as a conversation line, including image references."""
+    msg_text = f'{message["role"].upper()}: {message["content"]}'
+    if message.get("image_url"):
+        msg_text += f' [Image: {message["image_url"]}]'
+    return msg_text
+
+
+def _get_mime_type_from_path(path: str, ext: Optional[str] = None) -> str:
+    """Determine MIME type from file extension (pass ext when it is already known)."""
+    if ext is None:
+        ext = os.path.splitext(path)[1].lower()
+    return _MIME_TYPES.get(ext, 'image/jpeg')  # default
+
 
+def _url_image_ext(url: str) -> Optional[str]:
+    """Known image extension of a URL's path (ignoring query/fragment), else None."""
+    path = url.split('#', 1)[0].split('?', 1)[0]
+    ext = os.path.splitext(path)[1].lower()
+    return ext if ext in _MIME_TYPES else None
 
-def _load_local_image(file_path: str) -> Optional[types.Part]:
+
+def _load_local_image(file_path: str, ext: Optional[str] = None) -> Optional[types.Part]:
     """
     Load an image from a local file and return it as a Google GenAI Part.
     Returns None if file doesn't exist or can't be read.
@@ -117,7 +455,7 @@ def _load_local_image(file_path: str) -> Optional[types.Part]:
             image_bytes = f.read()
         
         # Determine mime type from file extension
-        mime_type = _get_mime_type_from_path(file_path)
+        mime_type = _get_mime_type_from_path(file_path, ext)
         
         # Create Google GenAI Part object from bytes
         part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
@@ -127,48 +465,91 @@ def _load_local_image(file_path: str) -> Optional[types.Part]:
         return None
 
 
-def _download_image_from_url(url: str) -> Optional[types.Part]:
+def _fetch_image_bytes(url: str) -> tuple[bytes, str]:
     """
-    Download an image from a URL and return it as a Google GenAI Part.
-    Returns None if download fails.
+    Download an image and return (bytes, mime_type).
+    Results are memoized per URL in _IMAGE_CACHE; failures raise and are therefore never cached.
     """
-    try:
-        # Add headers to avoid 403 Forbidden errors from websites
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Referer': url
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
+    cached = _IMAGE_CACHE.get(url)
+    if cached is not None:
+        return cached
+    result = _download_image_bytes(url)
+    _IMAGE_CACHE.put(url, result)
+    return result
+
+
+def _download_image_bytes(url: str) -> tuple[bytes, str]:
+    """Download an image (size-capped) and return (bytes, mime_type)."""
+    # Session supplies the browser-like defaults; Referer is per URL
+    with _HTTP.get(url, headers={'Referer': url}, timeout=10, stream=True) as response:
         response.raise_for_status()
         
+        # Reject oversized images before reading the body when the server tells us the size
+        content_length = int(response.headers.get('content-length') or 0)
+        if content_length > MAX_IMAGE_BYTES:
+            raise ValueError(f"image is {content_length} bytes (max {MAX_IMAGE_BYTES})")
+        
+        # Stream the body with a hard cap instead of materializing response.content
+        buf = bytearray()
+        for chunk in response.iter_content(chunk_size=65536):
+            buf.extend(chunk)
+            if len(buf) > MAX_IMAGE_BYTES:
+                raise ValueError(f"image exceeds {MAX_IMAGE_BYTES} bytes")
+        
         # Determine mime type from response or file extension
         content_type = response.headers.get('content-type', '').lower()
-        if 'image/' in content_type:
-            mime_type = content_type.split(';')[0]  # Remove any charset info
-        else:
-            mime_type = _get_mime_type_from_path(url)
+    
+    if 'image/' in content_type:
+        mime_type = content_type.split(';')[0]  # Remove any charset info
+    else:
+        mime_type = _get_mime_type_from_path(url)
+    
+    return bytes(buf), mime_type
+
+
+def _download_image_from_url(url: str) -> Optional[types.Part]:
+    """
+    Download an image from a URL and return it as a Google GenAI Part.
+    Returns None if download fails.
+    """
+    try:
+        image_bytes, mime_type = _fetch_image_bytes(url)
         
         # Create Google GenAI Part object from bytes
-        part = types.Part.from_bytes(data=response.content, mime_type=mime_type)
+        part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
         return part
     except Exception as e:
+        # Don't keep serving bytes that couldn't be turned into a Part
+        _IMAGE_CACHE.discard(url)
         print(f"Warning: Failed to download image from {url}: {e}")
         return None
 
 
-def _load_image(source: str) -> Optional[types.Part]:
+def _load_image(source: str, ext: Optional[str] = None) -> Optional[types.Part]:
     """
     Load an image from either a URL or local file path as a Part object.
+    `ext` is the file extension if the caller already knows it.
     Returns None if loading fails.
     """
     # Check if it's a URL or local file
     if source.startswith('http://') or source.startswith('https://'):
         return _download_image_from_url(source)
     else:
-        return _load_local_image(source)
+        return _load_local_image(source, ext)
+
+
+def _load_images(sources: List[str], exts: Optional[List[Optional[str]]] = None) -> List[types.Part]:
+    """
+    Load several images concurrently (URLs and/or local paths).
+    `exts`, if given, holds the known extension for each source (or None).
+    Images that fail to load are skipped; order of the remaining parts is preserved.
+    """
+    if exts is None:
+        exts = [None] * len(sources)
+    if len(sources) == 1:
+        part = _load_image(sources[0], exts[0])
+        return [part] if part else []
+    return [part for part in _IMAGE_POOL.map(_load_image, sources, exts) if part]
 
 
 # ============================================================================
@@ -200,6 +581,115 @@ def _load_reference_json(reference_filename: str) -> Optional[Dict[str, Any]:
 """
 
 
+@lru_cache(maxsize=None)
+def _ensure_credentials(service_account_path: str) -> bool:
+    """
+    Point GOOGLE_APPLICATION_CREDENTIALS at the service account file if it exists.
+    Cached so agents created per session don't stat the file again.
+    """
+    if os.path.exists(service_account_path):
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account_path
+        return True
+    print(f"Warning: Service account file not found at {service_account_path}")
+    return False
+
+
+# Shared read-only stand-in for missing design_guidelines sections (no dict per lookup)
+_NO_GUIDELINES: Mapping[str, Any] = MappingProxyType({})
+
+
+def _build_text_question(design_guidelines: Any) -> str:
+    """
+    Build the Step 5.5 question asking for overlay text, based on the typography
+    of a reference's design_guidelines (generic question if none is available).
+    """
+    # Build dynamic text question based on design_guidelines from reference
+    text_elements = []
+    if isinstance(design_guidelines, dict):
+        typography = design_guidelines.get('typography') or _NO_GUIDELINES
+
+        # Check for headline
+        headline = typography.get('headline') or _NO_GUIDELINES
+        if headline:
+            purpose = headline.get('text_purpose', 'frase destacada')
+            if purpose == 'product name':
+                text_elements.append("- **Nombre del producto** (título principal)")
+            elif purpose == 'benefit':
+                text_elements.append("- **Beneficio principal** (ej: 'Hidratación profunda', 'Rendimiento mejorado')")
+            elif purpose == 'offer':
+                text_elements.append("- **Oferta destacada** (ej: '50% OFF', '3x2')")
+            elif purpose == 'question':
+                text_elements.append("- **Pregunta destacada** (ej: '¿Listo para el cambio?')")
+            else:
+                text_elements.append("- **Título principal o frase destacada**")
+
+        # Check for subheadline
+        subheadline = typography.get('subheadline') or _NO_GUIDELINES
+        if subheadline and subheadline.get('present', False):
+            purpose = subheadline.get('text_purpose', 'descripción')
+            if purpose == 'benefits':
+                text_elements.append("- **Beneficios adicionales** (características del producto)")
+            elif purpose == 'features':
+                text_elements.append("- **Características** (detalles técnicos o ingredientes)")
+            elif purpose == 'tagline':
+                text_elements.append("- **Tagline o frase secundaria**")
+            elif purpose == 'ingredients':
+                text_elements.append("- **Ingredientes o componentes principales**")
+            else:
+                text_elements.append("- **Texto secundario o subtítulo**")
+
+        # Check for badges
+        badges = typography.get('badges') or _NO_GUIDELINES
+        if badges and badges.get('present', False):
+            content = badges.get('content', '')
+            if 'discount' in content or 'price' in content:
+                text_elements.append("- **Descuento o precio especial** (ej: '30% OFF', '$999')")
+            elif 'certification' in content:
+                text_elements.append("- **Certificación o badge** (ej: 'Orgánico', 'Vegan', 'Cruelty-free')")
+            elif 'size' in content:
+                text_elements.append("- **Tamaño o cantidad** (ej: '500ml', 'Pack x3')")
+            else:
+                text_elements.append("- **Badge o etiqueta destacada**")
+
+        # Check for CTA button
+        cta = design_guidelines.get('cta_button') or _NO_GUIDELINES
+        if cta and cta.get('present', False):
+            text_elements.append("- **Llamado a acción** (ej: 'Comprá ahora', 'Ver más', 'Link en bio')")
+
+    # Build the question
+    if text_elements:
+        elements_text = "\n".join(text_elements)
+        text_question = (
+            f"Perfecto! Basándome en la referencia que elegiste, necesito:\n\n"
+            f"{elements_text}\n\n"
+            "O decime **'sin texto'** si preferís la imagen sola."
+        )
+    else:
+        # Fallback to generic if no typography info available
+        text_question = (
+            "Perfecto! Ahora, ¿qué texto querés que tenga tu post de Instagram?\n\n"
+            "Podés incluir:\n"
+            "- Título principal o frase destacada\n"
+            "- Oferta o beneficio (ej: '3x2', 'Envío gratis')\n"
+            "- Llamado a acción (ej: 'Comprá ahora', 'Link en bio')\n\n"
+            "O decime **'sin texto'** si preferís la imagen sola."
+        )
+    return text_question
+
+
+@lru_cache(maxsize=4)
+def _get_client(project_id: str, region: str) -> genai.Client:
+    """
+    Vertex AI client shared by all agents for the same project/region,
+    so its HTTP connections (TLS + auth) are reused across sessions.
+    """
+    return genai.Client(
+        vertexai=True,
+        project=project_id,
+        location=region,
+    )
+
+
 class NanoBananaAgent:
     """
     Minimal stateful agent:
@@ -212,18 +702,16 @@ class NanoBananaAgent:
         self.project_id = project_id
         self.config = config
         
-        # Set the service account credentials path
-        if os.path.exists(service_account_path):
-            os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = service_account_path
-        else:
-            print(f"Warning: Service account file not found at {service_account_path}")
+        # Set the service account credentials path (checked once per path per process)
+        _ensure_credentials(service_account_path)
         
-        self.client = genai.Client(
-            vertexai=True,
-            project=self.project_id,
-            location=self.config.region,
-        )
-        self.history: List[Dict[str, Any]] = []  # [{"role":"user|assistant","content":"...","image_url":Optional[str]}]
+        self.client = _get_client(self.project_id, self.config.region)
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=HISTORY_MAXLEN)  # [{"role":"user|assistant","content":"...","image_url":Optional[str]}]
+        # Rendered lines for the last CONVERSATION_WINDOW messages, kept in sync with self.history
+        self._rendered_history: Deque[str] = deque(maxlen=CONVERSATION_WINDOW)
+        # References offered by the latest search since the last reset point
+        self._last_references: Optional[List[Dict[str, Any]]] = None
+        self._last_text_questions: List[str] = []  # Text question per reference, same order
         
         # Additional state for tool handlers
         self.backend_url = os.environ.get('BACKEND_URL', 'http://localhost:3000')
@@ -233,6 +721,53 @@ class NanoBananaAgent:
         self.awaiting_text_input = False  # Flag to track if we're waiting for text input
         self.design_guidelines = None  # Typography specs from selected reference (from SQLite)
         self.product_analysis = None  # Product image characteristics (colors, category, composition)
+        self.last_detected_source = None  # Image URL/path found in the most recent user message
+        self.session_id = uuid.uuid4().hex  # Groups this agent's lines in the history log
+        # Loaded Part for product_image_path, keyed by (path, mtime_ns); holds at most one entry
+        self._product_part_cache: Dict[Tuple[str, Optional[int]], types.Part] = {}
+
+    def _add_message(self, message: Dict[str, Any]) -> None:
+        """Append a message to history and to the rendered conversation window."""
+        self.history.append(message)
+        self._rendered_history.append(_render_message(message))
+        if _HISTORY_LOG:
+            _HISTORY_LOG.write({"session": self.session_id, "ts": time.time(), **message})
+        if message.get("references"):
+            self._last_references = message["references"]
+            self._last_text_questions = message["text_questions"]
+        elif message.get("is_reset"):
+            self._last_references = None
+            self._last_text_questions = []
+
+    def _clear_history(self) -> None:
+        """Drop all history, including the rendered conversation window."""
+        self.history.clear()
+        self._rendered_history.clear()
+        self._last_references = None
+        self._last_text_questions = []
+
+    def _load_product_image(self) -> Optional[types.Part]:
+        """
+        Load self.product_image_path as a Part, reusing the previous load while the
+        path and (for local files) its mtime are unchanged.
+        """
+        path = self.product_image_path
+        if not path:
+            return None
+        mtime = None
+        if not path.startswith(_URL_SCHEMES):
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                return _load_image(path)  # Let the loader report the missing file
+        key = (path, mtime)
+        part = self._product_part_cache.get(key)
+        if part is None:
+            part = _load_image(path)
+            self._product_part_cache.clear()  # Evict the previous product image
+            if part:
+                self._product_part_cache[key] = part
+        return part
 
     def chat(self, user_message: str, image_path: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -243,6 +778,8 @@ class NanoBananaAgent:
         or
           { "type": "reference_options", "text": "...", "references": [...] }
         """
+        self.last_detected_source = None
+        
         # Store product image path if provided
         if image_path:
             self.product_image_path = image_path
@@ -250,7 +787,7 @@ class NanoBananaAgent:
         # Handle special reset conversation message
         if user_message == "RESET_CONVERSATION":
             # Clear all state to start fresh
-            self.history = []
+            self._clear_history()
             self.selected_reference = None
             self.product_image_path = None
             self.text_content = None
@@ -265,18 +802,10 @@ class NanoBananaAgent:
             }
         
         # Detect if user wants to start over with a new product
-        user_msg_lower = user_message.lower()
-        start_over_keywords = [
-            'otro producto', 'nueva imagen', 'nuevo producto', 'empezar de nuevo',
-            'start over', 'different product', 'another product', 'new product',
-            'quiero crear otra', 'vamos a crear una nueva', 'crear algo con otro',
-            'imagen de producto nueva', 'producto nueva'
-        ]
-        
-        if any(keyword in user_msg_lower for keyword in start_over_keywords):
+        if _START_OVER_RE.search(user_message):
             # User wants to start over - reset all state
-            print("[DEBUG] User requested to start over with new product - resetting state")
-            self.history = []
+            logger.debug("User requested to start over with new product - resetting state")
+            self._clear_history()
             self.selected_reference = None
             self.product_image_path = None
             self.text_content = None
@@ -286,7 +815,7 @@ class NanoBananaAgent:
             
             reset_msg = "¡Claro que sí! Entendido, vamos a empezar de nuevo. **Subí la foto del nuevo producto** y te ayudo a crear algo increíble. 📸"
             # Add a special marker to history to indicate a reset point
-            self.history.append({"role": "assistant", "content": reset_msg, "is_reset": True})
+            self._add_message({"role": "assistant", "content": reset_msg, "is_reset": True})
             return {
                 "type": "text",
                 "text": reset_msg
@@ -300,54 +829,83 @@ class NanoBananaAgent:
             user_message = "Hola"
         
         # Extract image URL or file path if present in the message
-        clean_text, image_source = _extract_image_url(user_message)
+        clean_text, image_source, image_ext = _extract_image_source(user_message)
+        self.last_detected_source = image_source
         
         # Store in history with optional image reference
-        self.history.append({
+        self._add_message({
             "role": "user", 
             "content": clean_text if clean_text else user_message,
             "image_url": image_source  # Can be URL or file path
         })
 
-        # Build conversation history for context, including image references
-        conversation_parts = []
-        for m in self.history[-12:]:
-            msg_text = f'{m["role"].upper()}: {m["content"]}'
-            if m.get("image_url"):
-                msg_text += f' [Image: {m["image_url"]}]'
-            conversation_parts.append(msg_text)
-        conversation = "\n".join(conversation_parts)
+        # Reference selection and text-input replies are answered locally, so they are
+        # handled before the prompt is built and the text model is called
 
+        # Check if user is selecting a reference (1, 2, 3)
+        if user_message.strip().isdigit():
+            selected_num = int(user_message.strip())
+            if 1 <= selected_num <= 3:
+                # Options from the last reference search (cleared at reset points)
+                refs = self._last_references
+                if refs and selected_num <= len(refs):
+                    self.selected_reference = refs[selected_num - 1]
+                    logger.debug("User selected reference #%d: %s", selected_num, self.selected_reference.get('filename'))
+                    
+                    # Store design_guidelines from selected reference (Step 5)
+                    self.design_guidelines = self.selected_reference.get('design_guidelines', {})
+                    if logger.isEnabledFor(logging.DEBUG):
+                        typography = self.design_guidelines.get('typography', {}) if isinstance(self.design_guidelines, dict) else 'N/A'
+                        logger.debug("Stored design_guidelines with typography: %s", typography)
+                    
+                    # Analyze product image for text adaptation (Step 5.4)
+                    if self.product_image_path:
+                        try:
+                            self.product_analysis = self._analyze_product_for_text_context()
+                            logger.debug("Product analysis completed: %s", self.product_analysis)
+                        except Exception as e:
+                            logger.debug("Product analysis failed: %s", e)
+                            self.product_analysis = None
+                    
+                    # After reference selection and product analysis, ask about text content (Step 5.5)
+                    self.awaiting_text_input = True
+                    
+                    # Question prepared from this reference's design_guidelines at search time
+                    text_question = self._last_text_questions[selected_num - 1]
+                    logger.debug("Using text question prepared for reference #%d", selected_num)
+                    self._add_message({"role": "assistant", "content": text_question})
+                    return {"type": "text", "text": text_question}
+        
+        # Check if we're waiting for text input from user (Step 5.5 response)
+        if self.awaiting_text_input:
+            return self._handle_text_input(user_message)
+        
         # Build the prompt that respects the system instructions workflow
-        full_prompt = f"""
-{self.config.system_instructions}
-
----
-
-CONVERSATION SO FAR:
-{conversation}
-
----
-
-INSTRUCTIONS:
-Follow your workflow as defined in the system instructions above. Have a natural conversation with the user.
-
-When you're ready to generate an image, use this exact format:
-[TRIGGER_GENERATE_NANOBANANA]
-IMAGE_PROMPT: <detailed single-line prompt for image generation>
-
-Otherwise, respond naturally to continue the conversation.
-""".strip()
+        conversation = "\n".join(self._rendered_history)
+        full_prompt = "".join((self.config.prompt_prefix, conversation, _PROMPT_SUFFIX))
 
         # Build content for Gemini - include image if present in current message or stored product image
         image_to_analyze = image_source or self.product_image_path
         
         if image_to_analyze:
-            # Load the image (from URL or local file) and convert to Google GenAI Part
-            image_part = _load_image(image_to_analyze)
-            if image_part:
-                # Multi-part content with text and image
-                content_parts = [full_prompt, image_part]
+            # Further image URLs left in the message (known image extension only,
+            # so links to shops/pages aren't fetched) are loaded alongside the main image
+            extra_urls = [u for u in _URL_RE.findall(clean_text) if _url_image_ext(u)]
+            sources = list(dict.fromkeys([image_to_analyze, *extra_urls]))
+            # Reuse the extension found while extracting a file path from this message
+            exts: List[Optional[str]] = [None] * len(sources)
+            if image_source:
+                exts[0] = image_ext
+            # Load the images (from URL or local file) and convert to Google GenAI Parts
+            if image_to_analyze == self.product_image_path:
+                # The stored product image comes back every turn; reuse the cached Part
+                product_part = self._load_product_image()
+                image_parts = ([product_part] if product_part else []) + _load_images(sources[1:], exts[1:])
+            else:
+                image_parts = _load_images(sources, exts)
+            if image_parts:
+                # Multi-part content with text and images
+                content_parts = [full_prompt, *image_parts]
                 print(f"Including product image in analysis: {image_to_analyze}")
             else:
                 # Image loading failed, use text only
@@ -366,158 +924,6 @@ Otherwise, respond naturally to continue the conversation.
         response_text = response.text or ""
         response_text_stripped = response_text.strip()
 
-        # Check if user is selecting a reference (1, 2, 3)
-        if user_message.strip().isdigit():
-            selected_num = int(user_message.strip())
-            if 1 <= selected_num <= 3:
-                # Find the last message with references (after any reset points)
-                for msg in reversed(self.history):
-                    # Stop searching if we hit a reset point
-                    if msg.get("is_reset"):
-                        break
-                    if msg.get("references"):
-                        refs = msg["references"]
-                        if selected_num <= len(refs):
-                            self.selected_reference = refs[selected_num - 1]
-                            print(f"[DEBUG] User selected reference #{selected_num}: {self.selected_reference.get('filename')}")
-                            
-                            # Store design_guidelines from selected reference (Step 5)
-                            self.design_guidelines = self.selected_reference.get('design_guidelines', {})
-                            print(f"[DEBUG] Stored design_guidelines with typography: {self.design_guidelines.get('typography', {}) if isinstance(self.design_guidelines, dict) else 'N/A'}")
-                            
-                            # Analyze product image for text adaptation (Step 5.4)
-                            if self.product_image_path:
-                                try:
-                                    self.product_analysis = self._analyze_product_for_text_context()
-                                    print(f"[DEBUG] Product analysis completed: {self.product_analysis}")
-                                except Exception as e:
-                                    print(f"[DEBUG] Product analysis failed: {e}")
-                                    self.product_analysis = None
-                            
-                            # After reference selection and product analysis, ask about text content (Step 5.5)
-                            self.awaiting_text_input = True
-                            
-                            # Build dynamic text question based on design_guidelines from reference
-                            text_elements = []
-                            if isinstance(self.design_guidelines, dict):
-                                typography = self.design_guidelines.get('typography', {})
-                                
-                                # Check for headline
-                                headline = typography.get('headline', {})
-                                if headline:
-                                    purpose = headline.get('text_purpose', 'frase destacada')
-                                    if purpose == 'product name':
-                                        text_elements.append("- **Nombre del producto** (título principal)")
-                                    elif purpose == 'benefit':
-                                        text_elements.append("- **Beneficio principal** (ej: 'Hidratación profunda', 'Rendimiento mejorado')")
-                                    elif purpose == 'offer':
-                                        text_elements.append("- **Oferta destacada** (ej: '50% OFF', '3x2')")
-                                    elif purpose == 'question':
-                                        text_elements.append("- **Pregunta destacada** (ej: '¿Listo para el cambio?')")
-                                    else:
-                                        text_elements.append("- **Título principal o frase destacada**")
-                                
-                                # Check for subheadline
-                                subheadline = typography.get('subheadline', {})
-                                if subheadline and subheadline.get('present', False):
-                                    purpose = subheadline.get('text_purpose', 'descripción')
-                                    if purpose == 'benefits':
-                                        text_elements.append("- **Beneficios adicionales** (características del producto)")
-                                    elif purpose == 'features':
-                                        text_elements.append("- **Características** (detalles técnicos o ingredientes)")
-                                    elif purpose == 'tagline':
-                                        text_elements.append("- **Tagline o frase secundaria**")
-                                    elif purpose == 'ingredients':
-                                        text_elements.append("- **Ingredientes o componentes principales**")
-                                    else:
-                                        text_elements.append("- **Texto secundario o subtítulo**")
-                                
-                                # Check for badges
-                                badges = typography.get('badges', {})
-                                if badges and badges.get('present', False):
-                                    content = badges.get('content', '')
-                                    if 'discount' in content or 'price' in content:
-                                        text_elements.append("- **Descuento o precio especial** (ej: '30% OFF', '$999')")
-                                    elif 'certification' in content:
-                                        text_elements.append("- **Certificación o badge** (ej: 'Orgánico', 'Vegan', 'Cruelty-free')")
-                                    elif 'size' in content:
-                                        text_elements.append("- **Tamaño o cantidad** (ej: '500ml', 'Pack x3')")
-                                    else:
-                                        text_elements.append("- **Badge o etiqueta destacada**")
-                                
-                                # Check for CTA button
-                                cta = self.design_guidelines.get('cta_button', {})
-                                if cta and cta.get('present', False):
-                                    text_elements.append("- **Llamado a acción** (ej: 'Comprá ahora', 'Ver más', 'Link en bio')")
-                            
-                            # Build the question
-                            if text_elements:
-                                elements_text = "\n".join(text_elements)
-                                text_question = (
-                                    f"Perfecto! Basándome en la referencia que elegiste, necesito:\n\n"
-                                    f"{elements_text}\n\n"
-                                    "O decime **'sin texto'** si preferís la imagen sola."
-                                )
-                            else:
-                                # Fallback to generic if no typography info available
-                                text_question = (
-                                    "Perfecto! Ahora, ¿qué texto querés que tenga tu post de Instagram?\n\n"
-                                    "Podés incluir:\n"
-                                    "- Título principal o frase destacada\n"
-                                    "- Oferta o beneficio (ej: '3x2', 'Envío gratis')\n"
-                                    "- Llamado a acción (ej: 'Comprá ahora', 'Link en bio')\n\n"
-                                    "O decime **'sin texto'** si preferís la imagen sola."
-                                )
-                            
-                            print(f"[DEBUG] Generated dynamic text question with {len(text_elements)} elements from design_guidelines")
-                            self.history.append({"role": "assistant", "content": text_question})
-                            return {"type": "text", "text": text_question}
-        
-        # Check if we're waiting for text input from user (Step 5.5 response)
-        if self.awaiting_text_input:
-            self.awaiting_text_input = False
-            
-            # Check if user wants no text
-            user_msg_lower = user_message.lower().strip()
-            no_text_keywords = ['sin texto', 'no texto', 'sin text', 'no text', 'imagen sola', 'ninguno', 'nada', 'skip']
-            
-            if any(keyword in user_msg_lower for keyword in no_text_keywords):
-                # User wants no text
-                self.text_content = None
-                print("[DEBUG] User chose no text overlay")
-                
-                ready_msg = (
-                    "Perfecto! Tengo todo listo para crear tu post sin texto:\n"
-                    f"- {self.selected_reference.get('description', 'Referencia seleccionada')}\n\n"
-                    "**Cuando quieras generar el post, apretá el botón 'Generar' y listo.**"
-                )
-                self.history.append({"role": "assistant", "content": ready_msg})
-                return {"type": "text", "text": ready_msg}
-            else:
-                # Parse user's text specifications
-                self.text_content = self._parse_text_content(user_message)
-                print(f"[DEBUG] User text content parsed: {self.text_content}")
-                
-                # Build preview of what will be included
-                text_preview_parts = []
-                if self.text_content.get('headline'):
-                    text_preview_parts.append(f"- Título: '{self.text_content['headline']}'")
-                if self.text_content.get('subheadline'):
-                    text_preview_parts.append(f"- Oferta/Subtítulo: '{self.text_content['subheadline']}'")
-                if self.text_content.get('cta'):
-                    text_preview_parts.append(f"- Llamado a acción: '{self.text_content['cta']}'")
-                
-                text_preview = "\n".join(text_preview_parts) if text_preview_parts else "- Texto personalizado"
-                
-                ready_msg = (
-                    "Perfecto! Tengo todo listo para crear tu post:\n"
-                    f"{text_preview}\n"
-                    f"- Basado en la referencia que elegiste\n\n"
-                    "**Cuando quieras generar el post, apretá el botón 'Generar' y listo.**"
-                )
-                self.history.append({"role": "assistant", "content": ready_msg})
-                return {"type": "text", "text": ready_msg}
-        
         # Check for reference search trigger
         if "[TRIGGER_SEARCH_REFERENCES]" in response_text_stripped:
             return self._handle_search_references(response_text_stripped)
@@ -531,17 +937,10 @@ Otherwise, respond naturally to continue the conversation.
             return self._handle_generate_reel(response_text_stripped)
 
         # Check if the agent wants to generate an image (legacy Gemini direct)
-        if "[TRIGGER_GENERATE_NANOBANANA]" in response_text_stripped or "CALL_TOOL: GENERATE_IMAGE" in response_text_stripped:
+        if _IMAGE_TRIGGER_RE.search(response_text_stripped):
             # Extract the image prompt
-            image_prompt = ""
-            for line in response_text.splitlines():
-                line_stripped = line.strip()
-                if line_stripped.startswith("IMAGE_PROMPT:"):
-                    image_prompt = line_stripped[len("IMAGE_PROMPT:"):].strip()
-                    break
-                elif line_stripped.startswith("PROMPT:"):
-                    image_prompt = line_stripped[len("PROMPT:"):].strip()
-                    break
+            prompt_match = _PROMPT_LINE_RE.search(response_text)
+            image_prompt = prompt_match.group(1).strip() if prompt_match else ""
             
             # If no explicit prompt found, extract text before the trigger
             if not image_prompt:
@@ -557,28 +956,72 @@ Otherwise, respond naturally to continue the conversation.
             
             if not img_bytes:
                 assistant_msg = "Image generation failed: no image bytes returned."
-                self.history.append({"role": "assistant", "content": assistant_msg})
+                self._add_message({"role": "assistant", "content": assistant_msg})
                 return {"type": "text", "text": assistant_msg}
 
-            # Create timestamp filename in format yyyyMMdd_hhmmss.png
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S.png")
+            # Create timestamp filename in format yyyyMMdd_hhmmss_N.png (N keeps same-second images apart)
+            timestamp = f"{time.strftime(_TIMESTAMP_FMT)}_{next(_image_counter)}.png"
             
-            with open(timestamp, "wb") as f:
-                f.write(img_bytes)
+            _write_bytes(timestamp, img_bytes)
 
             # Extract any text before the trigger to show to user
-            text_before_trigger = response_text_stripped.split("[TRIGGER_GENERATE_NANOBANANA]")[0].strip()
+            text_before_trigger = response_text_stripped.partition("[TRIGGER_GENERATE_NANOBANANA]")[0].strip()
             if not text_before_trigger:
                 text_before_trigger = f"✨ Generated image saved to {timestamp}"
             
             assistant_msg = f"{text_before_trigger}\n[Image generated: {timestamp}]"
-            self.history.append({"role": "assistant", "content": assistant_msg})
+            self._add_message({"role": "assistant", "content": assistant_msg})
             return {"type": "image", "file": timestamp, "text": text_before_trigger}
 
         # Regular conversation response
-        self.history.append({"role": "assistant", "content": response_text_stripped})
+        self._add_message({"role": "assistant", "content": response_text_stripped})
         return {"type": "text", "text": response_text_stripped}
     
+    def _handle_text_input(self, user_message: str) -> Dict[str, Any]:
+        """
+        Handle the user's answer to the text overlay question (Step 5.5).
+        Answered locally without calling the text model.
+        """
+        self.awaiting_text_input = False
+        
+        # Check if user wants no text
+        if _NO_TEXT_RE.search(user_message):
+            # User wants no text
+            self.text_content = None
+            logger.debug("User chose no text overlay")
+            
+            ready_msg = (
+                "Perfecto! Tengo todo listo para crear tu post sin texto:\n"
+                f"- {self.selected_reference.get('description', 'Referencia seleccionada')}\n\n"
+                "**Cuando quieras generar el post, apretá el botón 'Generar' y listo.**"
+            )
+            self._add_message({"role": "assistant", "content": ready_msg})
+            return {"type": "text", "text": ready_msg}
+        else:
+            # Parse user's text specifications
+            self.text_content = self._parse_text_content(user_message)
+            logger.debug("User text content parsed: %s", self.text_content)
+            
+            # Build preview of what will be included
+            text_preview_parts = []
+            if self.text_content.get('headline'):
+                text_preview_parts.append(f"- Título: '{self.text_content['headline']}'")
+            if self.text_content.get('subheadline'):
+                text_preview_parts.append(f"- Oferta/Subtítulo: '{self.text_content['subheadline']}'")
+            if self.text_content.get('cta'):
+                text_preview_parts.append(f"- Llamado a acción: '{self.text_content['cta']}'")
+            
+            text_preview = "\n".join(text_preview_parts) if text_preview_parts else "- Texto personalizado"
+            
+            ready_msg = (
+                "Perfecto! Tengo todo listo para crear tu post:\n"
+                f"{text_preview}\n"
+                f"- Basado en la referencia que elegiste\n\n"
+                "**Cuando quieras generar el post, apretá el botón 'Generar' y listo.**"
+            )
+            self._add_message({"role": "assistant", "content": ready_msg})
+            return {"type": "text", "text": ready_msg}
+
     def _parse_text_content(self, user_message: str) -> Dict[str, str]:
         """
         Parse user's text specifications into structured format.
@@ -587,19 +1030,13 @@ Otherwise, respond naturally to continue the conversation.
         text_content = {}
         
         # Simple heuristic parsing
-        # Look for common patterns in Spanish/English
-        msg_lower = user_message.lower()
-        
-        # Try to identify CTA (call to action) keywords
-        cta_keywords = ['comprá', 'compra', 'buy', 'shop', 'link en bio', 'link in bio', 'visita', 'visit', 'descubrí', 'descubre']
-        
         # Split by common separators
-        lines = user_message.replace(' y ', '\n').replace(' Y ', '\n').split('\n')
+        lines = _TEXT_SPLIT_RE.split(user_message)
         
         # Collect all text pieces
         text_pieces = []
         for line in lines:
-            line = line.strip().strip('"').strip("'").strip(',').strip()
+            line = line.strip(_TEXT_STRIP_CHARS)
             if line and len(line) > 1:
                 text_pieces.append(line)
         
@@ -612,7 +1049,8 @@ Otherwise, respond naturally to continue the conversation.
         elif len(text_pieces) == 2:
             # 2 pieces: check if second is CTA
             text_content['headline'] = text_pieces[0]
-            if any(kw in text_pieces[1].lower() for kw in cta_keywords):
+            # Try to identify CTA (call to action) keywords
+            if _CTA_RE.search(text_pieces[1]):
                 text_content['cta'] = text_pieces[1]
             else:
                 text_content['subheadline'] = text_pieces[1]
@@ -637,21 +1075,13 @@ Otherwise, respond naturally to continue the conversation.
         """
         try:
             # Extract fields after the trigger
-            block = response_text.split("[TRIGGER_GENERATE_REEL]", 1)[1]
-            lines = [ln.strip() for ln in block.splitlines() if ln.strip()]
-
-            product_image = None
-            prompt = None
-            caption = None
-
-            for ln in lines:
-                if ln.startswith("PRODUCT_IMAGE:"):
-                    v = ln.split(":", 1)[1].strip()
-                    product_image = v if v else None
-                elif ln.startswith("PROMPT:"):
-                    prompt = ln.split(":", 1)[1].strip()
-                elif ln.startswith("CAPTION:"):
-                    caption = ln.split(":", 1)[1].strip()
+            block = response_text.partition("[TRIGGER_GENERATE_REEL]")[2]
+            # Last occurrence of each field wins
+            fields = {m.group(1): m.group(2).strip() for m in _REEL_FIELDS_RE.finditer(block)}
+
+            product_image = fields.get("PRODUCT_IMAGE") or None
+            prompt = fields.get("PROMPT")
+            caption = fields.get("CAPTION")
 
             if not prompt:
                 return {"type": "text", "text": "Faltó el PROMPT para generar el reel."}
@@ -675,7 +1105,7 @@ Otherwise, respond naturally to continue the conversation.
             if internal_token:
                 headers["X-Postty-Internal-Token"] = internal_token
 
-            print(f"[DEBUG] Calling backend /video/generate for user {str(user_id)[:8]}...", file=sys.stderr, flush=True)
+            logger.debug("Calling backend /video/generate for user %.8s...", user_id)
             # Always send multipart/form-data (Fastify expects multipart parsing on this endpoint).
             # If we don't attach a file, `requests` would otherwise default to x-www-form-urlencoded.
             with contextlib.ExitStack() as stack:
@@ -689,7 +1119,7 @@ Otherwise, respond naturally to continue the conversation.
                     # Force multipart even when no product image is available
                     files["_forceMultipart"] = ("force.txt", b"")
 
-                resp = requests.post(
+                resp = _post_multipart(
                     f"{backend_url}/video/generate",
                     data=data,
                     files=files,
@@ -746,7 +1176,7 @@ Return ONLY a JSON object with this structure:
 }"""
             
             # Load product image
-            image_part = _load_image(self.product_image_path)
+            image_part = self._load_product_image()
             if not image_part:
                 raise Exception("Failed to load product image")
             
@@ -758,21 +1188,17 @@ Return ONLY a JSON object with this structure:
             
             response_text = (response.text or "").strip()
             
-            # Try to parse JSON response
-            import json
             # Remove markdown code blocks if present
-            if response_text.startswith('```'):
-                response_text = response_text.split('```')[1]
-                if response_text.startswith('json'):
-                    response_text = response_text[4:]
-                response_text = response_text.strip()
+            fenced = _JSON_FENCE_RE.match(response_text)
+            if fenced:
+                response_text = fenced.group(1).strip()
             
-            analysis = json.loads(response_text)
-            print(f"[DEBUG] Product analysis result: {analysis}")
+            analysis = _json_loads(response_text)
+            logger.debug("Product analysis result: %s", analysis)
             return analysis
             
         except Exception as e:
-            print(f"[DEBUG] Product analysis error: {e}")
+            logger.debug("Product analysis error: %s", e)
             # Return safe defaults
             return {
                 'colors': ['#000000'],
@@ -788,28 +1214,20 @@ Return ONLY a JSON object with this structure:
         Search reference library and present options to user
         """
         # Extract QUERY and LIMIT parameters
-        query = ""
-        limit = 3
-        
-        for line in response_text.splitlines():
-            line_stripped = line.strip()
-            if line_stripped.startswith("QUERY:"):
-                query = line_stripped[len("QUERY:"):].strip()
-            elif line_stripped.startswith("LIMIT:"):
-                try:
-                    limit = int(line_stripped[len("LIMIT:"):].strip())
-                except:
-                    limit = 3
+        params = _tool_params(response_text)
+        query = params.get("QUERY", "")
+        try:
+            limit = int(params.get("LIMIT", 3))
+        except ValueError:
+            limit = 3
         
         if not query:
             # Fallback query from context
             query = "product photography professional"
         
         try:
-            import requests
-            
             # Call backend search endpoint
-            response = requests.post(
+            response = _BACKEND_HTTP.post(
                 f'{self.backend_url}/search-references',
                 json={'query': query, 'limit': limit},
                 timeout=10
@@ -821,8 +1239,14 @@ Return ONLY a JSON object with this structure:
                 # Format results for user display
                 references = result['results']
                 
+                # Backend returns 'tags' as a list; normalize older comma-separated strings once here
+                for ref in references:
+                    tags = ref.get('tags')
+                    if isinstance(tags, str):
+                        ref['tags'] = [t.strip() for t in tags.split(',') if t.strip()]
+                
                 # Build message showing the references
-                text_before_trigger = response_text.split("[TRIGGER_SEARCH_REFERENCES]")[0].strip()
+                text_before_trigger = response_text.partition("[TRIGGER_SEARCH_REFERENCES]")[0].strip()
                 if not text_before_trigger:
                     text_before_trigger = "Encontré estas referencias que podrían inspirar tu imagen:"
                 
@@ -830,37 +1254,28 @@ Return ONLY a JSON object with this structure:
                 
                 for i, ref in enumerate(references, 1):
                     # Use 'tags' instead of 'keywords' (backend returns 'tags')
-                    tags = ref.get('tags', [])
-                    # Tags might be a string (comma-separated) or list
-                    if isinstance(tags, str):
-                        tags = [t.strip() for t in tags.split(',') if t.strip()]
+                    tags = ref.get('tags')
                     tags_str = ", ".join(tags[:5]) if tags else ref.get('aesthetic', 'Sin estilo')
                     
                     # Build description from available fields (backend doesn't return 'description')
-                    description_parts = []
-                    if ref.get('industry'):
-                        description_parts.append(ref['industry'])
-                    if ref.get('aesthetic'):
-                        description_parts.append(ref['aesthetic'])
-                    if ref.get('mood'):
-                        description_parts.append(ref['mood'])
-                    description = " - ".join(description_parts) if description_parts else ref.get('filename', 'Referencia')
+                    description = " - ".join(v for k in _REFERENCE_DESC_KEYS if (v := ref.get(k))) or ref.get('filename', 'Referencia')
                     
-                    message_parts.append(
-                        f"{i}. {description}\n"
-                        f"   Estilo: {tags_str}"
-                    )
+                    # One entry per line; the final join inserts every newline
+                    message_parts.append(f"{i}. {description}")
+                    message_parts.append(f"   Estilo: {tags_str}")
                 
                 message_parts.append("")
                 message_parts.append("¿Cuál te gusta más? (1, 2, 3, o 'ninguna' si querés que genere sin referencia)")
                 
                 full_message = "\n".join(message_parts)
                 
-                # Store references in history for later use
-                self.history.append({
+                # Store references in history for later use, with the text question
+                # each one leads to (Step 5.5) so selecting it needs no extra work
+                self._add_message({
                     "role": "assistant",
                     "content": full_message,
-                    "references": references
+                    "references": references,
+                    "text_questions": [_build_text_question(ref.get('design_guidelines', {})) for ref in references]
                 })
                 
                 return {
@@ -870,14 +1285,14 @@ Return ONLY a JSON object with this structure:
                 }
             else:
                 fallback = "No encontré referencias exactas. ¿Querés que genere la imagen según tu descripción?"
-                self.history.append({"role": "assistant", "content": fallback})
+                self._add_message({"role": "assistant", "content": fallback})
                 return {"type": "text", "text": fallback}
                 
         except Exception as e:
             error_msg = f"Error buscando referencias: {str(e)}"
             print(error_msg)
             fallback = "Tuve un problema buscando referencias. ¿Seguimos sin referencias visuales?"
-            self.history.append({"role": "assistant", "content": fallback})
+            self._add_message({"role": "assistant", "content": fallback})
             return {"type": "text", "text": fallback}
     
     def _handle_generate_pipeline(self, response_text: str) -> Dict[str, Any]:
@@ -893,87 +1308,84 @@ Return ONLY a JSON object with this structure:
         # Use selected reference if available
         if self.selected_reference:
             reference_image = self.selected_reference.get('filename', '')
-            print(f"[DEBUG] Using stored selected reference: {reference_image}")
+            logger.debug("Using stored selected reference: %s", reference_image)
         
-        for line in response_text.splitlines():
-            line_stripped = line.strip()
-            # NOTE: Don't override product_image - we use the stored path from upload
-            # The LLM might hallucinate incorrect paths
-            # Only override reference if not already set from selection
-            if line_stripped.startswith("REFERENCE_IMAGE:") and not reference_image:
-                reference_image = line_stripped[len("REFERENCE_IMAGE:"):].strip()
-            elif line_stripped.startswith("PROMPT:"):
-                prompt = line_stripped[len("PROMPT:"):].strip()
-            elif line_stripped.startswith("SKIP_TEXT:"):
-                skip_text = line_stripped[len("SKIP_TEXT:"):].strip()
+        params = _tool_params(response_text)
+        # NOTE: Don't override product_image - we use the stored path from upload
+        # The LLM might hallucinate incorrect paths
+        # Only override reference if not already set from selection
+        if not reference_image:
+            reference_image = params.get("REFERENCE_IMAGE", "")
+        prompt = params.get("PROMPT", prompt)
+        skip_text = params.get("SKIP_TEXT", skip_text)
         
         if not product_image:
             error_msg = "No product image available for generation"
-            print(f"[DEBUG] No product image path stored")
-            self.history.append({"role": "assistant", "content": error_msg})
+            logger.debug("No product image path stored")
+            self._add_message({"role": "assistant", "content": error_msg})
             return {"type": "text", "text": error_msg}
         
-        print(f"[DEBUG] Using product image: {product_image}")
-        print(f"[DEBUG] Using reference: {reference_image}")
-        print(f"[DEBUG] Using prompt: {prompt}")
+        logger.debug("Using product image: %s", product_image)
+        logger.debug("Using reference: %s", reference_image)
+        logger.debug("Using prompt: %s", prompt)
         
         if not prompt:
             prompt = "Professional product photography with elegant composition"
         
         try:
-            import requests
-            import json
-            
             # Check if user provided text content
             has_text = self.text_content is not None and len(self.text_content) > 0
             
+            # Text specifications sent as JSON form fields when the user provided text
+            text_fields: Dict[str, str] = {}
+            if has_text:
+                logger.debug("User provided text: %s", self.text_content)
+                
+                # Convert text_content dict to ordered array (by position)
+                text_array = []
+                if self.text_content.get('headline'):
+                    text_array.append(self.text_content['headline'])
+                if self.text_content.get('subheadline'):
+                    text_array.append(self.text_content['subheadline'])
+                if self.text_content.get('cta'):
+                    text_array.append(self.text_content['cta'])
+                
+                logger.debug("Text array: %s", text_array)
+                text_fields['userText'] = _json_dumps(text_array)
+                
+                # Add typography guidelines from design_guidelines
+                if self.design_guidelines and self.design_guidelines.get('typography'):
+                    logger.debug("Including typography guidelines from SQLite")
+                    text_fields['typographyStyle'] = _json_dumps(self.design_guidelines['typography'])
+                
+                # Add product analysis for color adaptation
+                if self.product_analysis:
+                    logger.debug("Including product analysis for color adaptation")
+                    text_fields['productAnalysis'] = _json_dumps(self.product_analysis)
+            else:
+                # No text requested - generate base image only
+                logger.debug("No text content, generating base image only")
+            
+            data = {
+                'textPrompt': prompt,
+                'referenceImage': reference_image if reference_image else '',
+                'skipText': 'false' if has_text else 'true',  # 'false': let Gemini generate text
+                'language': 'es',
+                'aspectRatio': '1:1',
+                **text_fields,
+            }
+            
             # Build multipart form data with proper file handle management
             with open(product_image, 'rb') as product_file:
-                files = {'productImage': product_file}
-                data = {
-                    'textPrompt': prompt,
-                    'referenceImage': reference_image if reference_image else '',
-                    'skipText': 'false',  # Let Gemini generate text
-                    'language': 'es',
-                    'aspectRatio': '1:1',
-                }
-                
-                # Add text specifications if user provided text
-                if has_text:
-                    print(f"[DEBUG] User provided text: {self.text_content}")
-                    
-                    # Convert text_content dict to ordered array (by position)
-                    text_array = []
-                    if self.text_content.get('headline'):
-                        text_array.append(self.text_content['headline'])
-                    if self.text_content.get('subheadline'):
-                        text_array.append(self.text_content['subheadline'])
-                    if self.text_content.get('cta'):
-                        text_array.append(self.text_content['cta'])
-                    
-                    print(f"[DEBUG] Text array: {text_array}")
-                    data['userText'] = json.dumps(text_array)
-                    
-                    # Add typography guidelines from design_guidelines
-                    if self.design_guidelines and self.design_guidelines.get('typography'):
-                        print(f"[DEBUG] Including typography guidelines from SQLite")
-                        data['typographyStyle'] = json.dumps(self.design_guidelines['typography'])
-                    
-                    # Add product analysis for color adaptation
-                    if self.product_analysis:
-                        print(f"[DEBUG] Including product analysis for color adaptation")
-                        data['productAnalysis'] = json.dumps(self.product_analysis)
-                else:
-                    # No text requested - generate base image only
-                    data['skipText'] = 'true'
-                    print(f"[DEBUG] No text content, generating base image only")
+                files = {'productImage': (os.path.basename(product_image), product_file)}
                 
                 # Call pipeline endpoint - Gemini generates complete image with text
-                print(f"[DEBUG] Calling pipeline with skipText={data['skipText']}")
-                response = requests.post(
+                logger.debug("Calling pipeline with skipText=%s", data['skipText'])
+                # Streamed from disk when requests-toolbelt is installed
+                response = _post_multipart(
                     f'{self.backend_url}/pipeline',
-                    files=files,
                     data=data,
+                    files=files,
                     timeout=60  # Pipeline can take longer
                 )
             
@@ -982,34 +1394,25 @@ Return ONLY a JSON object with this structure:
             
             if not result.get('success') or not result.get('finalImagePath'):
                 error_msg = "La generación de imagen falló. ¿Intentamos de nuevo?"
-                self.history.append({"role": "assistant", "content": error_msg})
+                self._add_message({"role": "assistant", "content": error_msg})
                 return {"type": "text", "text": error_msg}
             
             final_image_path = result['finalImagePath']
-            print(f"[DEBUG] Complete image generated: {final_image_path}")
+            logger.debug("Complete image generated: %s", final_image_path)
             
             # Increment ranking for the reference that was used
+            # (fire-and-forget: the image is returned without waiting for the backend)
             if reference_image:
-                try:
-                    import os
-                    import requests
-                    reference_filename = os.path.basename(reference_image)
-                    print(f"[DEBUG] Incrementing ranking for reference: {reference_filename}", file=sys.stderr)
-                    requests.post(
-                        f'{self.backend_url}/increment-reference-ranking',
-                        json={'referenceFilename': reference_filename},
-                        timeout=5
-                    )
-                except Exception as e:
-                    print(f"[DEBUG] Failed to increment ranking: {e}", file=sys.stderr)
+                # Reference paths come from the backend and always use "/" separators
+                _BACKGROUND_POOL.submit(_increment_reference_ranking, self.backend_url, reference_image.rpartition('/')[2])
             
             # Extract text before trigger
-            text_before_trigger = response_text.split("[TRIGGER_GENERATE_PIPELINE]")[0].strip()
+            text_before_trigger = response_text.partition("[TRIGGER_GENERATE_PIPELINE]")[0].strip()
             if not text_before_trigger:
                 text_before_trigger = "✨ ¡Listo! Acá está tu imagen"
             
             assistant_msg = f"{text_before_trigger}\n[Image generated via pipeline]"
-            self.history.append({"role": "assistant", "content": assistant_msg})
+            self._add_message({"role": "assistant", "content": assistant_msg})
             
             # Build response with textLayout if available
             response = {
@@ -1028,7 +1431,7 @@ Return ONLY a JSON object with this structure:
             error_msg = f"Error generando imagen: {str(e)}"
             print(error_msg)
             fallback = "Tuve un problema generando la imagen. ¿Intentamos de nuevo?"
-            self.history.append({"role": "assistant", "content": fallback})
+            self._add_message({"role": "assistant", "content": fallback})
             return {"type": "text", "text": fallback}
 
 
@@ -1051,8 +1454,10 @@ if __name__ == "__main__":
         if msg.lower() in ("exit", "quit"):
             break
         
-        # Check if user provided an image URL or file path and give feedback
-        _, detected_source = _extract_image_url(msg)
+        result = agent.chat(msg)
+        
+        # Reuse the image URL or file path the agent already detected and give feedback
+        detected_source = agent.last_detected_source
         if detected_source:
             # Determine if it's a URL or file path
             if detected_source.startswith('http://') or detected_source.startswith('https://'):
@@ -1063,7 +1468,6 @@ if __name__ == "__main__":
             display_source = detected_source if len(detected_source) <= 60 else detected_source[:60] + "..."
             print(f"🖼️  Image {source_type} detected: {display_source}")
         
-        result = agent.chat(msg)
         if result["type"] == "text":
             print("\nAssistant:", result["text"], "\n")
         else:
@@ -8,54 +8,85 @@ import sys
 import os
 import time
 import threading
+import logging
+from collections import OrderedDict
 from agent import NanoBananaAgent, load_config
 
-# Ensure output is flushed immediately
-sys.stdout.reconfigure(line_buffering=True)
+try:
+    # Optional: faster JSON for the stdin/stdout protocol
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ensure log output is flushed immediately; stdout stays block-buffered and
+# is flushed once per response by send()
 sys.stderr.reconfigure(line_buffering=True)
 
+# Agent logs go to stderr (stdout carries the JSON responses); set AGENT_LOG_LEVEL=DEBUG to see [DEBUG] lines
+logging.basicConfig(
+    stream=sys.stderr,
+    level=os.environ.get('AGENT_LOG_LEVEL', 'INFO').upper(),
+    format='[%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def send(response: dict) -> None:
+    """Write one JSON response line to stdout as UTF-8 bytes"""
+    body = orjson.dumps(response) if orjson else json.dumps(response, ensure_ascii=False).encode()
+    sys.stdout.flush()  # Emit any pending print() text first so lines never interleave
+    sys.stdout.buffer.write(body + b"\n")
+    sys.stdout.buffer.flush()
+
 # Session management for multi-user support
-agents: dict[str, NanoBananaAgent] = {}
+# session_id -> (agent, last_used), least recently used first
+agents: OrderedDict[str, tuple[NanoBananaAgent, float]] = OrderedDict()
+agents_lock = threading.Lock()  # The cleanup timer runs on its own thread
 MAX_AGENTS = 100
 SESSION_TIMEOUT = 3600  # 1 hour in seconds
-session_last_used: dict[str, float] = {}
 
 def get_or_create_agent(session_id: str, project_id: str, config) -> NanoBananaAgent:
     """Get existing agent for session or create new one"""
     if len(agents) >= MAX_AGENTS:
         cleanup_old_sessions()
     
-    if session_id not in agents:
-        print(f"[DEBUG] Creating new agent for session: {session_id[:8]}...", 
-              file=sys.stderr, flush=True)
-        agents[session_id] = NanoBananaAgent(project_id=project_id, config=config)
-    
-    session_last_used[session_id] = time.time()
-    return agents[session_id]
+    with agents_lock:
+        entry = agents.get(session_id)
+        if entry is None:
+            logger.debug("Creating new agent for session: %.8s...", session_id)
+            agent = NanoBananaAgent(project_id=project_id, config=config)
+        else:
+            agent = entry[0]
+            agents.move_to_end(session_id)
+        agents[session_id] = (agent, time.time())
+    return agent
 
 def cleanup_old_sessions():
-    """Remove sessions inactive for more than SESSION_TIMEOUT"""
+    """Remove sessions inactive for more than SESSION_TIMEOUT (oldest first, stops at the first active one)"""
     current_time = time.time()
-    sessions_to_remove = [
-        sid for sid, last_used in session_last_used.items()
-        if current_time - last_used > SESSION_TIMEOUT
-    ]
-    for sid in sessions_to_remove:
-        print(f"[DEBUG] Removing inactive session: {sid[:8]}...", 
-              file=sys.stderr, flush=True)
-        agents.pop(sid, None)
-        session_last_used.pop(sid, None)
+    with agents_lock:
+        while agents:
+            sid, (_, last_used) = next(iter(agents.items()))
+            if current_time - last_used <= SESSION_TIMEOUT:
+                break
+            logger.debug("Removing inactive session: %.8s...", sid)
+            agents.popitem(last=False)
+
+def schedule_cleanup():
+    """Run periodic_cleanup in 5 minutes on a one-shot timer thread"""
+    timer = threading.Timer(300, periodic_cleanup)
+    timer.daemon = True  # Don't keep the process alive after stdin closes
+    timer.start()
 
 def periodic_cleanup():
-    """Background thread for session cleanup"""
-    while True:
-        time.sleep(300)  # Every 5 minutes
-        try:
-            cleanup_old_sessions()
-            if len(agents) > 0:
-                print(f"[DEBUG] Active sessions: {len(agents)}", file=sys.stderr, flush=True)
-        except Exception as e:
-            print(f"[ERROR] Cleanup failed: {e}", file=sys.stderr, flush=True)
+    """Session cleanup run by a one-shot daemon timer, which then schedules the next one"""
+    try:
+        cleanup_old_sessions()
+        if len(agents) > 0:
+            logger.debug("Active sessions: %d", len(agents))
+    except Exception as e:
+        logger.error("Cleanup failed: %s", e)
+    finally:
+        schedule_cleanup()
 
 def main():
     # Initialize configuration
@@ -63,37 +94,38 @@ def main():
     
     try:
         config = load_config()
+        # prompt.md is read lazily; load it now so a missing prompt fails startup
+        _ = config.prompt_prefix
         
         # Send ready signal (don't create agent yet, will create per session)
-        print(json.dumps({"status": "ready", "agent_id": config.agent_id}), flush=True)
+        send({"status": "ready", "agent_id": config.agent_id})
         
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}), flush=True)
+        send({"status": "error", "message": str(e)})
         sys.exit(1)
     
-    # Start background cleanup thread
-    cleanup_thread = threading.Thread(target=periodic_cleanup, daemon=True)
-    cleanup_thread.start()
-    print("[DEBUG] Started session cleanup thread", file=sys.stderr, flush=True)
+    # Schedule periodic session cleanup
+    schedule_cleanup()
+    logger.debug("Scheduled session cleanup")
     
     # Process messages from stdin with session isolation
-    for line in sys.stdin:
+    # Read raw bytes; both JSON parsers take UTF-8 bytes directly and ignore the trailing newline
+    for line in sys.stdin.buffer:
         try:
-            line = line.strip()
-            if not line:
+            if line.isspace():
                 continue
             
             # Log incoming request to stderr (won't interfere with JSON output)
-            print(f"[DEBUG] Received: {line}", file=sys.stderr, flush=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received: %s", line.decode(errors='replace').strip())
                 
-            request = json.loads(line)
+            request = orjson.loads(line) if orjson else json.loads(line)
             message = request.get('message', '')
             image_path = request.get('image_path')  # Optional product image path
             session_id = request.get('session_id', 'default')  # Session ID for multi-user support
             user_id = request.get('user_id')  # Optional Firebase uid (used for post attribution)
             
-            print(f"[DEBUG] Session: {session_id[:12]}..., Message: {message[:50] if message else 'None'}, Image: {image_path}", 
-                  file=sys.stderr, flush=True)
+            logger.debug("Session: %.12s..., Message: %.50s, Image: %s", session_id, message or 'None', image_path)
             
             # Get or create agent for this specific session
             agent = get_or_create_agent(session_id, PROJECT_ID, config)
@@ -113,28 +145,28 @@ def main():
                 # If only image provided, use a placeholder message
                 if not message and image_path:
                     message = "[User uploaded product image]"
-                    print(f"[DEBUG] Using placeholder message for image", file=sys.stderr, flush=True)
+                    logger.debug("Using placeholder message for image")
                 
                 # Call session-specific agent with optional image path
-                print(f"[DEBUG] Calling agent.chat() for session {session_id[:8]}...", file=sys.stderr, flush=True)
+                logger.debug("Calling agent.chat() for session %.8s...", session_id)
                 result = agent.chat(message, image_path=image_path)
-                print(f"[DEBUG] Agent returned type: {result.get('type', 'unknown')}", file=sys.stderr, flush=True)
+                logger.debug("Agent returned type: %s", result.get('type', 'unknown'))
                 response = {"status": "success", "result": result}
             
-            print(json.dumps(response), flush=True)
+            send(response)
             
         except json.JSONDecodeError as e:
             error_msg = f"Invalid JSON: {str(e)}"
-            print(f"[ERROR] {error_msg}", file=sys.stderr, flush=True)
+            logger.error(error_msg)
             error_response = {"status": "error", "message": error_msg}
-            print(json.dumps(error_response), flush=True)
+            send(error_response)
         except Exception as e:
             error_msg = f"Exception: {str(e)}"
-            print(f"[ERROR] {error_msg}", file=sys.stderr, flush=True)
+            logger.error(error_msg)
             import traceback
-            print(f"[ERROR] Traceback: {traceback.format_exc()}", file=sys.stderr, flush=True)
+            logger.error("Traceback: %s", traceback.format_exc())
             error_response = {"status": "error", "message": str(e)}
-            print(json.dumps(error_response), flush=True)
+            send(error_response)
 
 if __name__ == "__main__":
     main()
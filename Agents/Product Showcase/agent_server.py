@@ -27,6 +27,8 @@ logger.info(f"Initializing agent with project: {PROJECT_ID}")
 
 try:
     config = load_config()
+    # prompt.md is read lazily; load it now so a missing prompt fails startup
+    _ = config.prompt_prefix
     agent = NanoBananaAgent(project_id=PROJECT_ID, config=config)
     logger.info(f"Agent loaded successfully: {config.agent_id}")
 except Exception as e:
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test script to verify agent_direct's session handling.
+This tests the session LRU, the cleanup timer and the JSON line output without
+creating real agents, waiting on real timers or needing Gemini API calls.
+"""
+
+import io
+import json
+import sys
+import threading
+
+import agent_direct
+
+
+class _Clock:
+    """Replaces agent_direct's time module so session ages can be set directly."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+def _new_agent(project_id, config):
+    return object()
+
+
+class _Timer:
+    """Records timers instead of starting threads."""
+
+    created = []
+
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.daemon = False
+        self.started = False
+        _Timer.created.append(self)
+
+    def start(self):
+        self.started = True
+
+
+def _report(title, checks):
+    print("=" * 70)
+    print(title)
+    print("=" * 70)
+    print()
+
+    passed = 0
+    failed = 0
+
+    for i, (name, ok) in enumerate(checks, 1):
+        if ok:
+            print(f"Test {i}: ✅ PASS  {name}")
+            passed += 1
+        else:
+            print(f"Test {i}: ❌ FAIL  {name}")
+            failed += 1
+
+    print()
+    print("=" * 70)
+    print(f"Results: {passed} passed, {failed} failed out of {len(checks)} tests")
+    print("=" * 70)
+    print()
+
+    return failed == 0
+
+
+def test_sessions():
+    """Test session reuse, LRU order and eviction of inactive sessions."""
+    checks = []
+
+    clock = _Clock()
+    saved = (agent_direct.time, agent_direct.NanoBananaAgent, agent_direct.MAX_AGENTS)
+    agent_direct.time = clock
+    agent_direct.NanoBananaAgent = _new_agent
+    agent_direct.agents.clear()
+    try:
+        # Sessions are created once and reused, most recently used last
+        a = agent_direct.get_or_create_agent("a", "test-project", None)
+        clock.now += 1
+        b = agent_direct.get_or_create_agent("b", "test-project", None)
+        clock.now += 1
+        c = agent_direct.get_or_create_agent("c", "test-project", None)
+        checks.append(("new sessions get their own agent", len({id(a), id(b), id(c)}) == 3))
+        checks.append(("sessions are kept oldest first", list(agent_direct.agents) == ["a", "b", "c"]))
+
+        clock.now += 1
+        again = agent_direct.get_or_create_agent("a", "test-project", None)
+        checks.append(("a known session reuses its agent", again is a))
+        checks.append(("using a session moves it to the end", list(agent_direct.agents) == ["b", "c", "a"]))
+        checks.append(("using a session refreshes its timestamp", agent_direct.agents["a"][1] == clock.now))
+
+        # Cleanup drops sessions past SESSION_TIMEOUT, oldest first, and keeps active ones
+        clock.now += agent_direct.SESSION_TIMEOUT - 1
+        agent_direct.cleanup_old_sessions()
+        checks.append(("cleanup removes only inactive sessions", list(agent_direct.agents) == ["c", "a"]))
+
+        clock.now += agent_direct.SESSION_TIMEOUT + 1
+        agent_direct.cleanup_old_sessions()
+        checks.append(("cleanup can empty the table", not agent_direct.agents))
+
+        # A full table is cleaned up before a new session is added
+        agent_direct.MAX_AGENTS = 3
+        for sid in ("a", "b", "c"):
+            agent_direct.get_or_create_agent(sid, "test-project", None)
+        clock.now += agent_direct.SESSION_TIMEOUT / 2
+        agent_direct.get_or_create_agent("b", "test-project", None)
+        clock.now += agent_direct.SESSION_TIMEOUT / 2 + 1
+        agent_direct.get_or_create_agent("d", "test-project", None)
+        checks.append(("a full table evicts inactive sessions first", list(agent_direct.agents) == ["b", "d"]))
+    finally:
+        agent_direct.time, agent_direct.NanoBananaAgent, agent_direct.MAX_AGENTS = saved
+        agent_direct.agents.clear()
+
+    return _report("Session Management Test Suite", checks)
+
+
+def test_cleanup_timer():
+    """Test that cleanup runs on a daemon one-shot timer that re-arms itself."""
+    checks = []
+
+    clock = _Clock()
+    saved = (threading.Timer, agent_direct.time, agent_direct.cleanup_old_sessions)
+    threading.Timer = _Timer
+    agent_direct.time = clock
+    agent_direct.agents.clear()
+    _Timer.created.clear()
+    try:
+        agent_direct.schedule_cleanup()
+        timer = _Timer.created[-1] if _Timer.created else None
+        checks.append(("a cleanup timer is scheduled",
+                       timer is not None and timer.function is agent_direct.periodic_cleanup))
+        checks.append(("the timer fires after 5 minutes", timer is not None and timer.interval == 300))
+        checks.append(("the timer doesn't keep the process alive",
+                       timer is not None and timer.daemon and timer.started))
+
+        # Firing the timer cleans up and schedules the next run
+        agent_direct.agents["old"] = (object(), clock.now - agent_direct.SESSION_TIMEOUT - 1)
+        agent_direct.agents["new"] = (object(), clock.now)
+        timer.function()
+        checks.append(("firing the timer runs the cleanup", list(agent_direct.agents) == ["new"]))
+        checks.append(("firing the timer arms the next one",
+                       len(_Timer.created) == 2 and _Timer.created[-1].started and _Timer.created[-1].daemon))
+
+        # A failing cleanup still re-arms the timer
+        def failing_cleanup():
+            raise RuntimeError("cleanup failed")
+
+        agent_direct.cleanup_old_sessions = failing_cleanup
+        _Timer.created[-1].function()
+        checks.append(("a failed cleanup still arms the next timer",
+                       len(_Timer.created) == 3 and _Timer.created[-1].started))
+    finally:
+        threading.Timer, agent_direct.time, agent_direct.cleanup_old_sessions = saved
+        agent_direct.agents.clear()
+
+    return _report("Cleanup Timer Test Suite", checks)
+
+
+def test_send():
+    """Test that responses go out as one UTF-8 JSON line each, after pending print() text."""
+    checks = []
+
+    raw = io.BytesIO()
+    saved = sys.stdout
+    out = io.TextIOWrapper(raw, encoding="utf-8")  # Held so it isn't collected (closing raw)
+    sys.stdout = out
+    try:
+        print("log line from a tool handler")
+        agent_direct.send({"status": "success", "result": {"type": "text", "text": "¡Listo! 📸"}})
+        agent_direct.send({"status": "error", "message": "No message or image provided"})
+    finally:
+        sys.stdout = saved
+
+    lines = raw.getvalue().split(b"\n")
+    checks.append(("print() text comes before the response", lines[0] == b"log line from a tool handler"))
+    checks.append(("one line per response, newline-terminated", len(lines) == 4 and lines[3] == b""))
+    checks.append(("responses are valid JSON",
+                   [json.loads(line)["status"] for line in lines[1:3]] == ["success", "error"]))
+    checks.append(("non-ASCII text is sent as UTF-8", "¡Listo! 📸".encode("utf-8") in lines[1]))
+
+    return _report("JSON Output Test Suite", checks)
+
+
+if __name__ == "__main__":
+    results = [test_sessions(), test_cleanup_timer(), test_send()]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the turns chat() answers without the text model.
+This tests reference selection ("1"-"3") and the text-overlay reply on a real
+NanoBananaAgent, with a stand-in client that records model calls.
+"""
+
+import sys
+
+from agent import NanoBananaAgent, load_config
+
+
+REFERENCES = [
+    {"filename": "a.png", "description": "Minimal", "design_guidelines": {"typography": {}}},
+    {"filename": "b.png", "description": "Bold", "design_guidelines": {}},
+    {"filename": "c.png", "description": "Fun"},
+]
+TEXT_QUESTIONS = ["¿Texto para A?", "¿Texto para B?", "¿Texto para C?"]
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+
+
+class _Models:
+    """Records generate_content calls and answers with plain text."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model, contents):
+        self.calls.append(contents[0])
+        return _Response("Respuesta del modelo")
+
+
+class _Client:
+    def __init__(self):
+        self.models = _Models()
+
+
+def _new_agent(references=REFERENCES):
+    agent = NanoBananaAgent(project_id="test-project", config=load_config())
+    agent.client = _Client()
+    if references:
+        agent._add_message({
+            "role": "assistant",
+            "content": "Elegí una referencia",
+            "references": references,
+            "text_questions": TEXT_QUESTIONS[:len(references)],
+        })
+    return agent
+
+
+def test_chat_shortcuts():
+    """Test which turns skip the text model and what state they leave behind."""
+    checks = []
+
+    # Picking a reference answers with that reference's prepared question
+    agent = _new_agent()
+    result = agent.chat(" 2 ")
+    checks.append(("selection returns the prepared question",
+                   result == {"type": "text", "text": TEXT_QUESTIONS[1]}))
+    checks.append(("selection skips the text model", agent.client.models.calls == []))
+    checks.append(("selection stores the reference and its guidelines",
+                   agent.selected_reference is REFERENCES[1] and agent.design_guidelines == {}))
+    checks.append(("selection waits for the text reply", agent.awaiting_text_input))
+    checks.append(("selection turn is kept in history",
+                   [m["content"] for m in list(agent.history)[-2:]] == [" 2 ", TEXT_QUESTIONS[1]]))
+
+    # The text reply is parsed locally as well
+    result = agent.chat("Verano 2x1 y Comprá ya")
+    checks.append(("text reply skips the text model", agent.client.models.calls == []))
+    checks.append(("text reply is parsed",
+                   agent.text_content == {"headline": "Verano 2x1", "cta": "Comprá ya"}))
+    checks.append(("text reply ends the wait", not agent.awaiting_text_input))
+    checks.append(("text reply confirms the post", "Verano 2x1" in result["text"]))
+
+    agent = _new_agent()
+    agent.chat("1")
+    result = agent.chat("sin texto")
+    checks.append(("'sin texto' skips the overlay",
+                   agent.text_content is None and "sin texto" in result["text"]
+                   and agent.client.models.calls == []))
+
+    # Anything else goes to the model, with the turn already in the prompt
+    agent = _new_agent()
+    agent.chat("5")
+    checks.append(("out-of-range number goes to the model",
+                   len(agent.client.models.calls) == 1 and "USER: 5" in agent.client.models.calls[0]))
+
+    agent = _new_agent(references=REFERENCES[:1])
+    agent.chat("2")
+    checks.append(("number past the offered references goes to the model",
+                   len(agent.client.models.calls) == 1 and agent.selected_reference is None))
+
+    agent = _new_agent(references=None)
+    agent.chat("1")
+    checks.append(("number without a search goes to the model", len(agent.client.models.calls) == 1))
+
+    agent = _new_agent()
+    agent.chat("quiero otro producto")
+    agent.chat("1")
+    checks.append(("a reset point forgets the offered references",
+                   len(agent.client.models.calls) == 1 and agent.selected_reference is None))
+
+    print("=" * 70)
+    print("Chat Shortcut Test Suite")
+    print("=" * 70)
+    print()
+
+    passed = 0
+    failed = 0
+
+    for i, (name, ok) in enumerate(checks, 1):
+        if ok:
+            print(f"Test {i}: ✅ PASS  {name}")
+            passed += 1
+        else:
+            print(f"Test {i}: ❌ FAIL  {name}")
+            failed += 1
+
+    print()
+    print("=" * 70)
+    print(f"Results: {passed} passed, {failed} failed out of {len(checks)} tests")
+    print("=" * 70)
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = test_chat_shortcuts()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the agent's bounded history.
+This tests NanoBananaAgent's history deque and rendered conversation window
+without needing Gemini API calls.
+"""
+
+import sys
+
+from agent import (
+    CONVERSATION_WINDOW,
+    HISTORY_MAXLEN,
+    NanoBananaAgent,
+    _render_message,
+    load_config,
+)
+
+
+def test_history_window():
+    """Test that history and the conversation window stay bounded and in sync."""
+    agent = NanoBananaAgent(project_id="test-project", config=load_config())
+
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}",
+         "image_url": "foto.png" if i % 5 == 0 else None}
+        for i in range(HISTORY_MAXLEN + 10)
+    ]
+
+    def window_matches():
+        expected = [_render_message(m) for m in list(agent.history)[-CONVERSATION_WINDOW:]]
+        return list(agent._rendered_history) == expected
+
+    checks = []
+
+    for message in messages[:3]:
+        agent._add_message(message)
+    checks.append(("short history is kept whole", list(agent.history) == messages[:3]))
+    checks.append(("short window matches history", window_matches()))
+
+    for message in messages[3:]:
+        agent._add_message(message)
+    checks.append(("history keeps the last HISTORY_MAXLEN messages",
+                   list(agent.history) == messages[-HISTORY_MAXLEN:]))
+    checks.append(("window holds CONVERSATION_WINDOW lines",
+                   len(agent._rendered_history) == CONVERSATION_WINDOW))
+    checks.append(("window matches the newest messages", window_matches()))
+    checks.append(("image references are rendered",
+                   any("[Image: foto.png]" in line for line in agent._rendered_history)))
+
+    agent._clear_history()
+    checks.append(("clear empties history and window",
+                   not agent.history and not agent._rendered_history))
+
+    print("=" * 70)
+    print("History Window Test Suite")
+    print("=" * 70)
+    print()
+
+    passed = 0
+    failed = 0
+
+    for i, (name, ok) in enumerate(checks, 1):
+        if ok:
+            print(f"Test {i}: ✅ PASS  {name}")
+            passed += 1
+        else:
+            print(f"Test {i}: ❌ FAIL  {name}")
+            failed += 1
+
+    print()
+    print("=" * 70)
+    print(f"Results: {passed} passed, {failed} failed out of {len(checks)} tests")
+    print("=" * 70)
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = test_history_window()
+    sys.exit(0 if success else 1)
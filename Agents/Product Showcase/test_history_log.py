@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Test script to verify the JSONL chat history log.
+This tests _HistoryLog / _open_history_log and the agent's use of them
+without needing Gemini API calls.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+import agent
+from agent import NanoBananaAgent, _HistoryLog, _open_history_log, load_config
+
+
+class _FullDisk:
+    """Stand-in file whose writes fail like a full disk."""
+
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        raise OSError(28, "No space left on device")
+
+
+def _read_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_history_log():
+    """Test that messages land in the log in order and that failures don't stall it."""
+    checks = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Messages are written in order, one JSON object per line, on close()
+        path = os.path.join(tmp, "history.jsonl")
+        log = _HistoryLog(path)
+        for i in range(50):
+            log.write({"i": i, "text": "café ☕"})
+        log.write({"when": object})  # Not JSON-serializable; stored via str()
+        log.close()
+        lines = _read_lines(path)
+        checks.append(("messages are written in order",
+                       [line.get("i") for line in lines[:50]] == list(range(50))))
+        checks.append(("non-ASCII text round-trips", lines[0]["text"] == "café ☕"))
+        checks.append(("unserializable values are stored as text",
+                       lines[50] == {"when": str(object)}))
+        checks.append(("writer thread stops on close", not log._thread.is_alive()))
+
+        # The log appends to an existing file
+        log = _HistoryLog(path)
+        log.write({"i": 50})
+        log.close()
+        checks.append(("reopening appends", len(_read_lines(path)) == 52))
+
+        # A failing write is logged and dropped; the writer keeps draining and closes promptly
+        log = _HistoryLog(os.path.join(tmp, "full.jsonl"))
+        log._file.close()
+        log._file = _FullDisk()
+        log.write({"i": 0})
+        time.sleep(0.1)
+        log.write({"i": 1})
+        time.sleep(0.1)
+        still_draining = log._thread.is_alive()
+        started = time.monotonic()
+        log.close()
+        checks.append(("writer survives failed writes",
+                       still_draining and not log._thread.is_alive() and time.monotonic() - started < 1))
+
+        # The directory is created on open; an unusable path disables the log
+        nested = os.path.join(tmp, "logs", "chat", "history.jsonl")
+        log = _open_history_log(nested)
+        checks.append(("missing directories are created", log is not None and os.path.exists(nested)))
+        if log:
+            log.close()
+        checks.append(("unusable path disables the log", _open_history_log(tmp) is None))
+        checks.append(("empty path disables the log", _open_history_log("") is None))
+
+        # The agent tags each message with its session id
+        agent_path = os.path.join(tmp, "agent.jsonl")
+        previous = agent._HISTORY_LOG
+        agent._HISTORY_LOG = _HistoryLog(agent_path)
+        try:
+            bot = NanoBananaAgent(project_id="test-project", config=load_config())
+            bot._add_message({"role": "user", "content": "hola", "image_url": None})
+            bot._add_message({"role": "assistant", "content": "¡Hola!"})
+        finally:
+            agent._HISTORY_LOG.close()
+            agent._HISTORY_LOG = previous
+        lines = _read_lines(agent_path)
+        checks.append(("agent messages are logged with their session",
+                       [(line["session"], line["role"], line["content"]) for line in lines]
+                       == [(bot.session_id, "user", "hola"), (bot.session_id, "assistant", "¡Hola!")]))
+
+    print("=" * 70)
+    print("History Log Test Suite")
+    print("=" * 70)
+    print()
+
+    passed = 0
+    failed = 0
+
+    for i, (name, ok) in enumerate(checks, 1):
+        if ok:
+            print(f"Test {i}: ✅ PASS  {name}")
+            passed += 1
+        else:
+            print(f"Test {i}: ❌ FAIL  {name}")
+            failed += 1
+
+    print()
+    print("=" * 70)
+    print(f"Results: {passed} passed, {failed} failed out of {len(checks)} tests")
+    print("=" * 70)
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = test_history_log()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script to verify tool parameter parsing.
+This tests the _tool_params function without needing Gemini API calls.
+"""
+
+import sys
+
+from agent import _tool_params
+
+
+def test_tool_params():
+    """Test parameter extraction from search / pipeline trigger responses."""
+
+    test_cases = [
+        # (model response, expected params)
+        (
+            "Busco referencias\n[TRIGGER_SEARCH_REFERENCES]\nQUERY: minimal skincare\nLIMIT: 3",
+            {"QUERY": "minimal skincare", "LIMIT": "3"}
+        ),
+        (
+            "[TRIGGER_GENERATE_PIPELINE]\nPROMPT: nice photo\nREFERENCE_IMAGE: ref.png\nSKIP_TEXT: false",
+            {"PROMPT": "nice photo", "REFERENCE_IMAGE": "ref.png", "SKIP_TEXT": "false"}
+        ),
+        # Indented lines and padding around values
+        (
+            "  QUERY:   bold red  \n\tLIMIT:5\r",
+            {"QUERY": "bold red", "LIMIT": "5"}
+        ),
+        # The first non-empty REFERENCE_IMAGE wins
+        (
+            "REFERENCE_IMAGE: first.png\nREFERENCE_IMAGE: second.png",
+            {"REFERENCE_IMAGE": "first.png"}
+        ),
+        (
+            "REFERENCE_IMAGE:\nREFERENCE_IMAGE: second.png\nREFERENCE_IMAGE: third.png",
+            {"REFERENCE_IMAGE": "second.png"}
+        ),
+        # Every other key keeps its last occurrence
+        (
+            "QUERY: one\nPROMPT: a\nQUERY: two\nPROMPT: b\nSKIP_TEXT: true\nSKIP_TEXT: false",
+            {"QUERY": "two", "PROMPT": "b", "SKIP_TEXT": "false"}
+        ),
+        # Keys only count at the start of a line, and are case-sensitive
+        (
+            "Usá QUERY: no\nIMAGE_PROMPT: no\nquery: no\nLIMIT 3",
+            {}
+        ),
+        (
+            "Respuesta normal sin parámetros",
+            {}
+        ),
+    ]
+
+    print("=" * 70)
+    print("Tool Parameter Test Suite")
+    print("=" * 70)
+    print()
+
+    passed = 0
+    failed = 0
+
+    for i, (response_text, expected) in enumerate(test_cases, 1):
+        print(f"Test {i}:")
+        print(f"  Input: {response_text[:60]!r}...")
+
+        result = _tool_params(response_text)
+
+        if result == expected:
+            print(f"  ✅ PASS")
+            passed += 1
+        else:
+            print(f"  ❌ FAIL")
+            failed += 1
+            print(f"     Expected: {expected}")
+            print(f"     Got:      {result}")
+        print()
+
+    print("=" * 70)
+    print(f"Results: {passed} passed, {failed} failed out of {len(test_cases)} tests")
+    print("=" * 70)
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = test_tool_params()
+    sys.exit(0 if success else 1)
@@ -4,44 +4,9 @@ Test script to verify URL extraction functionality.
 This tests the _extract_image_url function without needing Gemini API calls.
 """
 
-import re
 import sys
-from typing import Optional
 
-
-def _extract_image_url(message: str) -> tuple[str, Optional[str]]:
-    """
-    Extract image URL or file path from message text.
-    Returns (clean_text, image_source) where image_source can be a URL or file path.
-    """
-    # Pattern to match HTTP/HTTPS URLs
-    url_pattern = r'https?://[^\s]+'
-    
-    # Find all URLs in the message
-    urls = re.findall(url_pattern, message)
-    
-    if urls:
-        # Use the first URL found
-        image_source = urls[0]
-        # Remove the URL from the message to get clean text
-        clean_text = re.sub(re.escape(image_source), '', message).strip()
-    else:
-        # Look for file paths (common patterns)
-        # Matches: /path/to/file.jpg, ./file.png, ~/file.jpg, file.jpeg, etc.
-        file_pattern = r'(?:\.{0,2}/)?(?:[\w\-~/]+/)*[\w\-]+\.(?:jpg|jpeg|png|gif|webp|bmp)'
-        files = re.findall(file_pattern, message, re.IGNORECASE)
-        
-        if files:
-            image_source = files[0]
-            # Remove the file path from the message
-            clean_text = re.sub(re.escape(image_source), '', message).strip()
-        else:
-            return message, None
-    
-    # Clean up extra whitespace
-    clean_text = ' '.join(clean_text.split())
-    
-    return clean_text, image_source
+from agent import _extract_image_url
 
 
 def test_url_extraction():
@@ -96,6 +61,42 @@ def test_url_extraction():
             "My file is in current directory",
             "image.jpg"
         ),
+        # Paths wrapped in punctuation or glued to a prefix
+        (
+            "Mirá `./img/a.png` por favor",
+            "Mirá `` por favor",
+            "./img/a.png"
+        ),
+        (
+            "Usá *foto.png* como base",
+            "Usá ** como base",
+            "foto.png"
+        ),
+        (
+            "La imagen «foto.png» es la mejor",
+            "La imagen «» es la mejor",
+            "foto.png"
+        ),
+        (
+            "Subí foto.png-final ayer",
+            "Subí -final ayer",
+            "foto.png"
+        ),
+        (
+            "foto:producto.png",
+            "foto:",
+            "producto.png"
+        ),
+        (
+            "Está en fotos//producto.png ahora",
+            "Está en ahora",
+            "fotos//producto.png"
+        ),
+        (
+            "archivo=foto.jpg",
+            "archivo=",
+            "foto.jpg"
+        ),
         (
             "No image or URL here just text",
             "No image or URL here just text",
@@ -1,27 +1,76 @@
+import importlib.util
+import os
 import sys
 
+_SESSION = None
+
+
+def _get_session():
+    # Loading the ONNX model dominates a cutout; keep one session per process so
+    # importers calling cutout() repeatedly only pay for it once.
+    # REMBG_MODEL picks a lighter model, e.g. "u2netp" (~4.7MB vs ~170MB, faster on
+    # CPU, slightly rougher edges).
+    global _SESSION
+    if _SESSION is None:
+        from rembg import new_session  # type: ignore
+
+        _SESSION = new_session(os.environ.get("REMBG_MODEL", "").strip() or "u2net")
+    return _SESSION
+
+
+def cutout(inp, outp):
+    # "-" streams through stdin/stdout so chained callers can skip temp files.
+    from rembg import remove  # type: ignore
+
+    if inp == "-":
+        data = sys.stdin.buffer.read()
+    else:
+        with open(inp, "rb") as f:
+            data = f.read()
+    result = remove(data, session=_get_session())
+    if outp == "-":
+        sys.stdout.buffer.write(result)
+        sys.stdout.buffer.flush()
+    else:
+        with open(outp, "wb") as f:
+            f.write(result)
+
+
+_IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def cutout_dir(inp_dir, out_dir):
+    # One process and one loaded model for a whole shoot instead of one per image.
+    os.makedirs(out_dir, exist_ok=True)
+    for entry in sorted(os.scandir(inp_dir), key=lambda e: e.name):
+        if entry.is_file() and entry.name.lower().endswith(_IMAGE_EXTS):
+            stem = os.path.splitext(entry.name)[0]
+            cutout(entry.path, os.path.join(out_dir, stem + ".png"))
+
 
 def main():
     # Usage: python3 scripts/rembg_cutout.py input_image output_png
+    # Either path may be "-" for stdin/stdout. If input_image is a directory,
+    # output_png is a directory that receives <name>.png for every image in it.
     if len(sys.argv) != 3:
         print("usage: rembg_cutout.py <input_image> <output_png>", file=sys.stderr)
         return 2
 
     inp = sys.argv[1]
     outp = sys.argv[2]
+    if outp == "-" and os.path.isdir(inp):
+        print("output must be a directory when input is a directory", file=sys.stderr)
+        return 2
 
-    try:
-        from rembg import remove  # type: ignore
-    except Exception as e:
-        print(f"rembg not available: {e}", file=sys.stderr)
+    if importlib.util.find_spec("rembg") is None:
+        print("rembg not available: module not found", file=sys.stderr)
         return 3
 
     try:
-        with open(inp, "rb") as f:
-            data = f.read()
-        result = remove(data)
-        with open(outp, "wb") as f:
-            f.write(result)
+        if os.path.isdir(inp):
+            cutout_dir(inp, outp)
+        else:
+            cutout(inp, outp)
         return 0
     except Exception as e:
         print(f"rembg failed: {e}", file=sys.stderr)
@@ -30,5 +79,3 @@ def main():
 
 if __name__ == "__main__":
     raise SystemExit(main())
-
-